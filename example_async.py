@@ -0,0 +1,35 @@
+import asyncio
+import random
+
+import pygame
+
+from pharmaasync import AsyncPharmaScreen
+from pharmacontroller import SCREEN_SIZE
+
+
+async def randomize(screen):
+    image = screen.acquire()
+    while screen.running:
+        # Randomize the values of 10 pixels
+        for i in range(10):
+            image[random.randrange(SCREEN_SIZE), random.randrange(SCREEN_SIZE)] = random.random()
+
+        await screen.present(image)
+
+
+async def print_keys(screen):
+    while screen.running:
+        event = await screen.events.get()
+        if event.type == pygame.KEYDOWN:
+            print(f"Key pressed: {pygame.key.name(event.key)}")
+
+
+async def main():
+    async with AsyncPharmaScreen() as screen:
+        await asyncio.gather(randomize(screen), print_keys(screen))
+
+
+if __name__ == "__main__":
+    pygame.init()
+    asyncio.run(main())
+    pygame.quit()
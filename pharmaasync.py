@@ -0,0 +1,149 @@
+"""
+asyncio version of PharmaScreen, for modules written as coroutines.
+
+`await screen.present(frame)` sends the frame then yields to the other tasks until the next frame deadline,
+instead of blocking in `clock.tick`. Frames go through an asyncio datagram transport, whose replies
+(clock synchronization, panel acknowledgements) are handled as they arrive, and pygame events are
+polled by a background task and queued in `screen.events` (the latest MAX_QUEUED_EVENTS).
+
+    async def main():
+        async with AsyncPharmaScreen() as screen:
+            while screen.running:
+                image = screen.acquire()
+                ...
+                await screen.present()
+
+    pygame.init()
+    asyncio.run(main())
+"""
+
+import asyncio
+import socket
+import time
+from typing import Optional
+
+import numpy as np
+import pygame
+
+from pharmacontroller import FPS_2COLOR, Controller, PharmaScreen, frame_deadline
+
+EVENT_POLL_INTERVAL = 1 / 120  # Time between two polls of the pygame events (in s)
+MAX_QUEUED_EVENTS = 256  # Events kept for the modules that do not read `events`, the oldest being dropped
+MAX_WRITE_BUFFER = 8192  # Bytes buffered by a datagram transport above which new packets are dropped, as it never refuses them
+
+
+class ReplyProtocol(asyncio.DatagramProtocol):
+    def __init__(self, screen: "AsyncPharmaScreen", controller: "AsyncController"):
+        self.screen = screen
+        self.controller = controller
+
+    def datagram_received(self, data: bytes, address):
+        self.screen.handle_reply(data, self.controller, time.monotonic())
+
+    def error_received(self, exc: OSError):
+        # ICMP error of a previous send, or a send that failed: the transport reports them here instead of raising
+        self.controller.fail(str(exc))
+
+
+class AsyncController(Controller):
+    def __init__(self, *args, **kwargs):
+        """
+        A `Controller` sending its datagrams through an asyncio transport, set by `AsyncPharmaScreen.open`.
+        """
+        super().__init__(*args, **kwargs)
+        self.datagram_transport = None
+
+    def send_datagram(self, payload: bytes):
+        if self.datagram_transport is None:
+            super().send_datagram(payload)
+        elif self.datagram_transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            # Congested link: counted as lost like a full socket buffer, rather than queued without limit
+            raise BlockingIOError
+        else:
+            self.datagram_transport.sendto(payload)
+
+
+class AsyncPharmaScreen(PharmaScreen):
+    controller_class = AsyncController
+
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the arguments of `PharmaScreen`. Must be opened with `open`, or used as an async context manager.
+        """
+        super().__init__(*args, **kwargs)
+        self.running = True
+        self.events = asyncio.Queue(maxsize=MAX_QUEUED_EVENTS)
+        self.event_task = None
+        self.next_frame_time = None
+        self.pending_subframes = []
+
+    async def open(self) -> "AsyncPharmaScreen":
+        loop = asyncio.get_running_loop()
+        for controller in self.controllers:
+            # Resolved in the executor of the loop, as Controller.send would block the other tasks
+            addresses = await loop.getaddrinfo(controller.host, controller.port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            controller.address = addresses[0][4]
+            if self.transport == "udp":
+                # Connected, so that the replies of each controller reach its own protocol
+                controller.datagram_transport, _ = await loop.create_datagram_endpoint(
+                    lambda controller=controller: ReplyProtocol(self, controller), remote_addr=controller.address
+                )
+        self.event_task = asyncio.create_task(self.poll_events())
+        return self
+
+    async def close(self):
+        self.running = False
+        if self.event_task is not None:
+            self.event_task.cancel()
+        for controller in self.controllers:
+            if controller.datagram_transport is not None:
+                controller.datagram_transport.close()
+
+    async def __aenter__(self) -> "AsyncPharmaScreen":
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def poll_events(self):
+        """
+        Moves the pygame events to `events`, dropping the oldest ones once it is full. A QUIT event also clears `running`.
+        """
+        while self.running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.running = False
+                if self.events.full():
+                    self.events.get_nowait()
+                self.events.put_nowait(event)
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+    async def present(self, frame: Optional[np.ndarray] = None):
+        """
+        Displays `frame`, or the buffer returned by `acquire`, then waits for the next frame deadline.
+        """
+        if frame is None:
+            frame = self.framebuffers[self.back_index]
+            self.back_index = (self.back_index + 1) % len(self.framebuffers)
+        self.set_image(frame)
+
+        subframes, self.pending_subframes = self.pending_subframes, []
+        for subframe in subframes:
+            await self.sleep_until_deadline(1 / FPS_2COLOR)
+            self.set_bitframe(subframe)
+        if not subframes:
+            await self.sleep_until_deadline(1 / self.fps)
+
+    async def sleep_until_deadline(self, period: float):
+        now = time.perf_counter()
+        deadline = frame_deadline(self.next_frame_time, period, now)
+        await asyncio.sleep(deadline - now)
+        self.next_frame_time = deadline + period
+
+    def set_dithered(self, leds: np.ndarray):
+        # The sub-frames are paced by `present`
+        self.pending_subframes = list(self.dither_subframes(leds))
+
+    def wait_frame(self) -> int:
+        # Frames are paced by `present`, the clock only measures the framerate
+        return self.clock.tick()
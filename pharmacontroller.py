@@ -1,6 +1,12 @@
-import itertools
+import errno
+import heapq
 import json
-from typing import List
+import os
+import select
+import struct
+import time
+from typing import List, Optional
+import numpy as np
 import pygame
 import socket
 
@@ -12,30 +18,943 @@ FPS_2COLOR = 60
 FPS_8COLOR = 20
 GREEN_BRIGHTNESS = 180  # Brightness (0-255) of the brightest green
 COLOR_DEPTH = 3  # Number of bits in each shade of green
+DRAWABLE_PANELS = ((0, 1), (1, 0), (1, 1), (1, 2), (2, 1))  # Panels of the 3x3 grid that hold LEDs
+
+BLEND_MODES = ("replace", "max", "add", "multiply")
+WIRE_FORMATS = ("json", "binary", "panels")
+BINARY_MAGIC = b"PX"  # Header of binary frames, followed by the number of bit planes
+TIMED_MAGIC = b"PT"  # Header of binary frames with a presentation time, see `stamp_frame`
+SYNC_MAGIC = b"PC"  # Header of the clock synchronization packets, see `sync_request`
+SEQUENCE_MAGIC = b"PS"  # Header of frames carrying a frame id and their send time, see `sequence_frame`
+PANEL_MAGIC = b"PP"  # Header of the packets holding a single panel, see `encode_panels`
+PANEL_ACK_MAGIC = b"PA"  # Header of the acknowledgements of panel packets, see `panel_ack`
+TRANSPORTS = ("udp", "tcp")
+STREAM_SEND_BUFFER = 16384  # Kernel send buffer of stream connections (in bytes), kept small so that frames queue in PharmaScreen
+RECONNECT_DELAY = 1.0  # Time between two connection attempts to a controller over TCP (in s)
+HEARTBEAT_INTERVAL = 0.5  # Time after which an unchanged frame is sent again (in s)
+KEYFRAME_INTERVAL = 120  # Frames between two full refreshes of the panels, in case a controller restarted
+PENDING_PANELS = 16  # Unacknowledged frames remembered for each panel
+STALE_FRAMES = KEYFRAME_INTERVAL  # Older panel packets and acks within this many frames are ignored, beyond it the sender restarted
+SYNC_INTERVAL = 1.0  # Time between two clock synchronization requests to each controller (in s)
+SYNC_SAMPLES = 8  # Clock samples kept per controller, the one with the shortest round trip being used
+AUTO_2COLOR_FRAMES = 20  # Frames without mid-tones needed to switch to 2 colors in auto mode
+AUTO_8COLOR_FRAMES = 1  # Frames with mid-tones needed to switch back to 8 colors in auto mode
+DITHER_SUBFRAMES = FPS_2COLOR // FPS_8COLOR  # 1 bit sub-frames shown for each frame in dither mode
+SPIN_TIME = 0.002  # The last moments before a sub-frame deadline are busy-waited, as sleep is not precise enough
+CONTROLLER_PORT = 1337  # UDP port the controllers listen on
+MAX_SEND_FAILURES = 3  # Consecutive failed sends after which a controller is considered unreachable
+RETRY_FRAMES = 60  # Frames during which an unreachable controller is skipped before trying it again
+LUT_SIZE = 256  # Input resolution of the calibration lookup tables
+BAYER_4X4 = np.array([[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9], [15, 7, 13, 5]]) / 16
+
+
+class CrossGeometry:
+    def __init__(self, panel_size: int = PANEL_SIZE, panels=DRAWABLE_PANELS):
+        """
+        Precomputed layout of the LEDs on the cross.
+        LEDs are numbered in (row, column) order, so that each row of panels is a contiguous range of LED indices.
+        Attributes:
+            - `mask` is a boolean SCREEN_SIZE x SCREEN_SIZE array marking the pixels that match an LED.
+            - `n_leds` is the number of LEDs.
+            - `led_rows` and `led_cols` give the (row, column) of each LED index.
+            - `led_index` gives the LED index of each pixel, -1 for pixels without an LED.
+            - `panel_leds` gives the LED indices of each panel, in the order of `panels`.
+        """
+        self.panel_size = panel_size
+        self.size = 3 * panel_size
+        self.panels = tuple(panels)
+        self.mask = np.kron(
+            np.array([[(r, c) in self.panels for c in range(3)] for r in range(3)]),
+            np.ones((panel_size, panel_size), dtype=bool),
+        )
+        self.n_leds = int(self.mask.sum())
+        self.led_rows, self.led_cols = np.nonzero(self.mask)
+        self.flat_index = np.flatnonzero(self.mask)
+        self.led_index = np.full(self.mask.shape, -1)
+        self.led_index[self.mask] = np.arange(self.n_leds)
+        # Python lists for the loops that can't be vectorized (e.g. drawing the simulated LEDs)
+        self.led_coords = list(zip(self.led_rows.tolist(), self.led_cols.tolist()))
+
+        # LED range and number of LEDs per pixel row of each row of panels
+        self.bands = []
+        start = 0
+        for panel_row in range(3):
+            n_panels = sum(r == panel_row for r, _ in self.panels)
+            width = n_panels * panel_size
+            self.bands.append((start, width))
+            start += width * panel_size
+
+        # LED indices of each panel, in (row, column) order within the panel
+        self.panel_leds = np.array([
+            self.led_index[r * panel_size : (r + 1) * panel_size, c * panel_size : (c + 1) * panel_size].ravel()
+            for r, c in self.panels
+        ])
+
+        for array in (self.mask, self.led_rows, self.led_cols, self.flat_index, self.led_index, self.panel_leds):
+            array.flags.writeable = False
+
+    def is_drawable(self, row: int, col: int) -> bool:
+        """
+        Returns whether the given coordinates match an actual LED on the screen.
+        """
+        return 0 <= row < self.size and 0 <= col < self.size and bool(self.mask[row, col])
+
+    def to_leds(self, image, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Gathers the LED values of a square image into a flat array of `n_leds` values.
+        """
+        flat = np.asarray(image, dtype=float).reshape(-1)
+        if out is None:
+            return flat[self.flat_index]
+        return np.take(flat, self.flat_index, out=out)
+
+    def to_image(self, leds: np.ndarray, out: Optional[np.ndarray] = None, fill: float = 0.0) -> np.ndarray:
+        """
+        Scatters a flat array of LED values into a square image, pixels without LEDs being set to `fill`.
+        """
+        if out is None:
+            out = np.empty(self.mask.shape)
+        out.fill(fill)
+        out.reshape(-1)[self.flat_index] = leds
+        return out
+
+
+CROSS = CrossGeometry()
+# Boolean mask of the pixels matching an actual LED, indexed by (row, column)
+CROSS_MASK = CROSS.mask
+
+
+class CrossBuffer:
+    def __init__(self, data: Optional[np.ndarray] = None, geometry: CrossGeometry = CROSS):
+        """
+        A frame stored as one value per LED (1280 values instead of 48x48), in the LED order of `geometry`.
+        Rows of panels and single panels are available as zero-copy 2D views with `band` and `panel`.
+        """
+        self.geometry = geometry
+        self.data = np.zeros(geometry.n_leds) if data is None else np.asarray(data, dtype=float)
+        if self.data.shape != (geometry.n_leds,):
+            raise ValueError(f"Invalid buffer size (expected {geometry.n_leds} LEDs)")
+
+    @classmethod
+    def from_image(cls, image, geometry: CrossGeometry = CROSS) -> "CrossBuffer":
+        return cls(geometry.to_leds(image), geometry)
+
+    def to_image(self, out: Optional[np.ndarray] = None, fill: float = 0.0) -> np.ndarray:
+        return self.geometry.to_image(self.data, out, fill)
+
+    def band(self, panel_row: int) -> np.ndarray:
+        """
+        Zero-copy view of a row of panels, e.g. band(1) is the 16x48 horizontal bar of the cross.
+        """
+        start, width = self.geometry.bands[panel_row]
+        size = self.geometry.panel_size
+        return self.data[start : start + width * size].reshape(size, width)
+
+    def panel(self, panel_row: int, panel_col: int) -> np.ndarray:
+        """
+        Zero-copy 16x16 view of a single panel.
+        """
+        if (panel_row, panel_col) not in self.geometry.panels:
+            raise ValueError(f"Panel {(panel_row, panel_col)} has no LEDs")
+        position = sum(r == panel_row and c < panel_col for r, c in self.geometry.panels)
+        size = self.geometry.panel_size
+        return self.band(panel_row)[:, position * size : (position + 1) * size]
+
+    def fill(self, value: float):
+        self.data.fill(value)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class BitFrame:
+    def __init__(self, data: Optional[np.ndarray] = None, geometry: CrossGeometry = CROSS):
+        """
+        A black/green frame stored as one bit per LED, packed in LED order (160 bytes for the 1280 LEDs).
+        Supports `&`, `|`, `^` and `~` between frames, shifting and popcount, and is sent as-is in the binary wire format.
+        """
+        self.geometry = geometry
+        n_bytes = -(-geometry.n_leds // 8)
+        self.data = np.zeros(n_bytes, dtype=np.uint8) if data is None else np.asarray(data, dtype=np.uint8)
+        if self.data.shape != (n_bytes,):
+            raise ValueError(f"Invalid bit frame size (expected {n_bytes} bytes)")
+
+    @classmethod
+    def from_leds(cls, leds, geometry: CrossGeometry = CROSS) -> "BitFrame":
+        return cls(np.packbits(np.asarray(leds, dtype=bool)), geometry)
+
+    @classmethod
+    def from_image(cls, image, threshold: float = 0.5, geometry: CrossGeometry = CROSS) -> "BitFrame":
+        """
+        Pixels brighter than `threshold` are turned on, as in the 2 colors mode of `PharmaScreen`.
+        """
+        return cls.from_leds(geometry.to_leds(image) > threshold, geometry)
+
+    @classmethod
+    def from_bytes(cls, payload: bytes, geometry: CrossGeometry = CROSS) -> "BitFrame":
+        return cls(np.frombuffer(payload, dtype=np.uint8).copy(), geometry)
+
+    def to_leds(self) -> np.ndarray:
+        return np.unpackbits(self.data, count=self.geometry.n_leds).astype(bool)
+
+    def to_image(self, out: Optional[np.ndarray] = None, on: float = 1.0) -> np.ndarray:
+        return self.geometry.to_image(self.to_leds() * on, out)
+
+    def to_bytes(self) -> bytes:
+        return self.data.tobytes()
+
+    def copy(self) -> "BitFrame":
+        return BitFrame(self.data.copy(), self.geometry)
+
+    def clear(self):
+        self.data.fill(0)
+
+    def _locate(self, row: int, col: int):
+        index = self.geometry.led_index[row, col]
+        if index < 0:
+            raise ValueError(f"No LED at {(row, col)}")
+        return index // 8, np.uint8(0x80 >> (index % 8))
+
+    def get(self, row: int, col: int) -> bool:
+        byte, bit = self._locate(row, col)
+        return bool(self.data[byte] & bit)
+
+    def set(self, row: int, col: int, value: bool = True):
+        byte, bit = self._locate(row, col)
+        if value:
+            self.data[byte] |= bit
+        else:
+            self.data[byte] &= ~bit
+
+    def popcount(self) -> int:
+        """
+        Number of LEDs turned on.
+        """
+        return int(POPCOUNT[self.data].sum(dtype=np.int64))
+
+    def shift(self, dy: int = 0, dx: int = 0) -> "BitFrame":
+        """
+        Returns the frame moved by (dy, dx) pixels. Pixels moved out of the cross are lost, uncovered pixels are off.
+        """
+        image = np.zeros(self.geometry.mask.shape, dtype=bool)
+        image.reshape(-1)[self.geometry.flat_index] = self.to_leds()
+        shifted = np.zeros_like(image)
+        h, w = image.shape
+        shifted[max(dy, 0) : h + min(dy, 0), max(dx, 0) : w + min(dx, 0)] = image[
+            max(-dy, 0) : h - max(dy, 0), max(-dx, 0) : w - max(dx, 0)
+        ]
+        return BitFrame.from_leds(shifted.reshape(-1)[self.geometry.flat_index], self.geometry)
+
+    def __and__(self, other: "BitFrame") -> "BitFrame":
+        return BitFrame(self.data & other.data, self.geometry)
+
+    def __or__(self, other: "BitFrame") -> "BitFrame":
+        return BitFrame(self.data | other.data, self.geometry)
+
+    def __xor__(self, other: "BitFrame") -> "BitFrame":
+        return BitFrame(self.data ^ other.data, self.geometry)
+
+    def __invert__(self) -> "BitFrame":
+        inverted = ~self.data
+        # Padding bits past the last LED stay off
+        padding = len(self.data) * 8 - self.geometry.n_leds
+        if padding:
+            inverted[-1] &= np.uint8((0xFF << padding) & 0xFF)
+        return BitFrame(inverted, self.geometry)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, BitFrame) and np.array_equal(self.data, other.data)
+
+
+class Calibration:
+    def __init__(
+        self,
+        gamma: float = 1.0,
+        brightness: float = 1.0,
+        night_brightness: float = 0.25,
+        panel_gains=None,
+        led_gains=None,
+        geometry: CrossGeometry = CROSS,
+    ):
+        """
+        Corrects the brightness of the LEDs with lookup tables computed once, so each frame only costs a gather.
+        Output values are `gain * brightness * value ** gamma`, clipped to 1.0.
+        Args:
+            - `gamma` is the exponent applied to the input values.
+            - `brightness` is the global brightness of the day mode, and `night_brightness` the one of the night mode.
+            - `panel_gains` lists a gain for each panel, in the order of the geometry panels.
+            - `led_gains` lists a gain for each LED, in LED order. Multiplied with `panel_gains` if both are given.
+        """
+        self.geometry = geometry
+        self.gamma = gamma
+        self.brightness = brightness
+        self.night_brightness = night_brightness
+        self.night = False
+
+        panel_of_led = np.array(
+            [geometry.panels.index((r // geometry.panel_size, c // geometry.panel_size)) for r, c in geometry.led_coords]
+        )
+        gains = np.ones(len(geometry.panels)) if panel_gains is None else np.asarray(panel_gains, dtype=float)
+        if gains.shape != (len(geometry.panels),):
+            raise ValueError(f"Expected {len(geometry.panels)} panel gains")
+        if led_gains is None:
+            # One table per panel, each LED reading the table of its panel
+            self.table_index = panel_of_led
+        else:
+            led_gains = np.asarray(led_gains, dtype=float)
+            if led_gains.shape != (geometry.n_leds,):
+                raise ValueError(f"Expected {geometry.n_leds} LED gains")
+            gains = gains[panel_of_led] * led_gains
+            self.table_index = np.arange(geometry.n_leds)
+
+        curve = np.linspace(0.0, 1.0, LUT_SIZE) ** gamma
+        self.day_tables = np.minimum(gains[:, None] * brightness * curve, 1.0)
+        self.night_tables = np.minimum(gains[:, None] * night_brightness * curve, 1.0)
+
+    @classmethod
+    def load(cls, path: str, geometry: CrossGeometry = CROSS) -> "Calibration":
+        """
+        Reads a calibration from a JSON object holding any of the arguments of the constructor, e.g.
+        {"gamma": 2.2, "brightness": 0.9, "panel_gains": [1.0, 0.85, 1.0, 0.9, 1.0]}
+        """
+        with open(path, "r") as f:
+            settings = json.load(f)
+        return cls(geometry=geometry, **settings)
+
+    def set_night_mode(self, night: bool = True):
+        self.night = night
+
+    def apply(self, leds: np.ndarray) -> np.ndarray:
+        """
+        Returns the corrected value (0.0 to 1.0) of each LED.
+        """
+        tables = self.night_tables if self.night else self.day_tables
+        inputs = np.rint(np.asarray(leds) * (LUT_SIZE - 1)).astype(np.intp)
+        return tables[self.table_index, inputs]
+
+
+class StreamConnection:
+    def __init__(self, address):
+        """
+        Non-blocking TCP connection to a controller, each frame being prefixed by its length (4 bytes, big endian).
+        At most one frame waits while another is being written: a newer frame replaces it, so that a congested
+        link shows the latest frame with a bounded delay instead of queuing old ones.
+        """
+        self.address = address
+        self.socket = None
+        self.connected = False
+        self.outgoing = memoryview(b"")  # Unsent end of the frame being written
+        self.queued = None  # Next frame to write
+        self.dropped = 0  # Frames replaced by a newer one before being written
+        self.written = 0  # Frames written whole to the connection
+        self.lost = 0  # Frames cut by a connection failure while being written
+        self.connections = 0
+        self.next_attempt = 0.0
+        self.last_error = None
+
+    def connect(self) -> bool:
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setblocking(False)
+        # Frames are written whole, there is nothing to gain from Nagle's algorithm
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, STREAM_SEND_BUFFER)
+        error = self.socket.connect_ex(self.address)
+        if error not in (0, errno.EINPROGRESS):
+            self.fail(os.strerror(error))
+            return False
+        self.connected = error == 0
+        if self.connected:
+            self.connections += 1
+        return True
+
+    @property
+    def pending(self) -> bool:
+        """
+        Whether a frame waits to be written on the open connection.
+        """
+        return self.socket is not None and (bool(self.outgoing) or self.queued is not None)
+
+    def fail(self, error: str):
+        """
+        Closes the connection and schedules a new attempt. The frame being written is lost, the queued one is kept.
+        """
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = None
+        self.connected = False
+        if self.outgoing:
+            self.lost += 1
+        self.outgoing = memoryview(b"")
+        self.last_error = error
+        self.next_attempt = time.monotonic() + RECONNECT_DELAY
+
+    def send(self, payload: bytes) -> bool:
+        """
+        Queues a frame and writes as much as the connection accepts. Returns False if the connection failed.
+        """
+        if self.queued is not None:
+            self.dropped += 1
+        self.queued = struct.pack(">I", len(payload)) + payload
+        return self.flush()
+
+    def flush(self) -> bool:
+        if self.socket is None:
+            if time.monotonic() < self.next_attempt:
+                return True  # Waiting to reconnect, the queued frame is written once connected
+            if not self.connect():
+                return False
+        if not self.connected:
+            _, writable, _ = select.select([], [self.socket], [], 0)
+            if not writable:
+                return True  # Still connecting
+            error = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                self.fail(os.strerror(error))
+                return False
+            self.connected = True
+            self.connections += 1
+
+        try:
+            while True:
+                if not self.outgoing:
+                    if self.queued is None:
+                        return True
+                    self.outgoing, self.queued = memoryview(self.queued), None
+                self.outgoing = self.outgoing[self.socket.send(self.outgoing):]
+                if not self.outgoing:
+                    self.written += 1
+        except BlockingIOError:
+            return True  # Congested, the queued frame waits for the next flush
+        except OSError as e:
+            self.fail(str(e))
+            return False
+
+
+def is_endpoint_tuple(endpoint) -> bool:
+    """
+    Whether `endpoint` is a single (host, port) tuple, rather than several endpoints.
+    """
+    return (
+        isinstance(endpoint, tuple) and len(endpoint) == 2
+        and isinstance(endpoint[0], str) and isinstance(endpoint[1], int)
+    )
+
+
+class Controller:
+    def __init__(self, endpoint, transport: str = "udp"):
+        """
+        A cross controller receiving the frames, with its delivery counters.
+        Args:
+            - `endpoint` is "host", "host:port" or a (host, port) tuple. The port defaults to CONTROLLER_PORT.
+            - `transport` is "udp" (datagrams) or "tcp" (a `StreamConnection` on the same port).
+        """
+        if isinstance(endpoint, str):
+            host, _, port = endpoint.partition(":")
+            endpoint = (host, int(port) if port else CONTROLLER_PORT)
+        # A bare number is a port given as a string, e.g. ("10.0.0.1", "1338"), not a host
+        if not is_endpoint_tuple(endpoint) or endpoint[0].isdigit():
+            raise ValueError(f"Invalid controller endpoint {endpoint!r}, expected \"host\", \"host:port\" or (host, port)")
+        self.host, self.port = endpoint
+        self.address = None  # Resolved on the first send
+        self.transport = transport
+        self.stream = None
+        # Connected UDP socket, so that an ICMP error (e.g. port unreachable) is reported by the next send
+        self.socket = None
+        self.sent = 0
+        self.lost = 0
+        self.skipped = 0
+        self.failures = 0  # Consecutive failed sends
+        self.last_send_ok = False
+        self.retry_in = 0  # Frames left before trying an unreachable controller again
+        self.last_error = None
+
+        # Clock synchronization: (round trip time, offset) samples, the offset being controller clock - local clock
+        self.clock_samples = []
+        self.offset = None
+        self.round_trip = None
+        self.lateness = None  # Display time of the last frame relative to its presentation time, as reported by the controller
+        self.last_sync = None
+
+        # Panel packets: content of each panel last acknowledged by the controller, and the ones still in flight
+        self.acked_panels = {}
+        self.acked_frames = {}  # Frame id of the content in `acked_panels`, older acks being ignored
+        self.pending_panels = {}
+        self.panels_skipped = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.failures < MAX_SEND_FAILURES
+
+    def send(self, payload: bytes) -> bool:
+        """
+        Sends a packet without blocking. Returns whether it was handed to the network.
+        The counters include the clock synchronization packets.
+        """
+        if self.retry_in > 0:
+            self.skipped += 1
+            return False
+        try:
+            if self.address is None:
+                self.address = socket.getaddrinfo(self.host, self.port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+            if self.transport == "tcp":
+                self.stream = self.stream or StreamConnection(self.address)
+                return self.check_stream(self.stream.send(payload))
+            self.send_datagram(payload)
+        except BlockingIOError:
+            # Full send buffer: the packet is dropped, but the controller is not to blame
+            self.lost += 1
+            return False
+        except OSError as e:
+            self.fail(str(e))
+            return False
+        self.sent += 1
+        # An unreachable port is only reported by the packet after the one refused,
+        # so the controller is trusted again after two successful sends in a row
+        if self.last_send_ok:
+            self.failures = 0
+        self.last_send_ok = True
+        return True
+
+    def end_frame(self):
+        """
+        Counts down the frames left before trying an unreachable controller again, whatever the number of packets sent.
+        Writes the TCP output left by the previous sends, as the next send may be a heartbeat away.
+        """
+        if self.retry_in > 0:
+            self.retry_in -= 1
+        if self.stream is not None:
+            self.flush()
+
+    def flush(self) -> bool:
+        return self.check_stream(self.stream.flush())
+
+    def check_stream(self, ok: bool) -> bool:
+        """
+        Updates the health of a TCP controller after a write. Frames are counted by the stream once written,
+        and it retries the connection after RECONNECT_DELAY on its own.
+        """
+        if not ok:
+            self.fail(self.stream.last_error, lost=False)
+        elif self.stream.connected:
+            self.failures = 0
+        return ok
+
+    def send_datagram(self, payload: bytes):
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # A slow or unreachable controller must never stall the frame loop
+            self.socket.setblocking(False)
+            self.socket.connect(self.address)
+        self.socket.send(payload)
+
+    def receive(self) -> List[tuple]:
+        """
+        Returns the packets sent back by the controller since the last call, with the time they were read (time.monotonic).
+        """
+        replies = []
+        while self.socket is not None:
+            try:
+                reply = self.socket.recv(64)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self.fail(str(e))  # ICMP error of a previous send
+                continue
+            replies.append((reply, time.monotonic()))
+        return replies
+
+    def fail(self, error: str, lost: bool = True):
+        """
+        Counts a packet lost by the network, and backs off once the controller looks unreachable.
+        """
+        self.lost += lost
+        self.failures += 1
+        self.last_send_ok = False
+        self.last_error = error
+        if not self.healthy and self.transport == "udp":
+            self.retry_in = RETRY_FRAMES
+
+    def add_clock_sample(self, sent_at: float, received_at: float, replied_at: float, now: float, lateness: float):
+        """
+        Updates the clock offset from a synchronization exchange (NTP style), all times being in seconds:
+        `sent_at` and `now` in the local clock, `received_at` and `replied_at` in the controller clock.
+        """
+        round_trip = (now - sent_at) - (replied_at - received_at)
+        offset = ((received_at - sent_at) + (replied_at - now)) / 2
+        self.clock_samples = self.clock_samples[-(SYNC_SAMPLES - 1):] + [(round_trip, offset)]
+        # The exchange with the shortest round trip had the least queuing, so the most symmetric delays
+        self.round_trip, self.offset = min(self.clock_samples)
+        self.lateness = None if np.isnan(lateness) else lateness
+
+    def needs_panel(self, panel: int, data: bytes) -> bool:
+        """
+        Whether a panel must be sent, i.e. the controller did not acknowledge this exact content yet.
+        """
+        if self.acked_panels.get(panel) == data:
+            self.panels_skipped += 1
+            return False
+        return True
+
+    def sent_panel(self, frame_id: int, panel: int, data: bytes):
+        """
+        Records a panel sent to the controller. Once different content was sent, the controller may show it,
+        so the acknowledgement of the previous content no longer counts, nor do the late acks of older content.
+        """
+        if self.acked_panels.get(panel, data) != data:
+            del self.acked_panels[panel]
+        pending = self.pending_panels.setdefault(panel, {})
+        for old_id in [old_id for old_id, old_data in pending.items() if old_data != data]:
+            del pending[old_id]
+        # Keyed by the frame id on the wire, as found in the acks
+        pending[frame_id % 2**32] = data
+        if len(pending) > PENDING_PANELS:
+            del pending[next(iter(pending))]
+
+    def ack_panel(self, frame_id: int, panel: int):
+        """
+        Records the content acknowledged by the controller, unless a newer frame of the panel was acknowledged first.
+        """
+        data = self.pending_panels.get(panel, {}).pop(frame_id, None)
+        if data is not None and is_newer_frame(frame_id, self.acked_frames.get(panel)):
+            self.acked_panels[panel] = data
+            self.acked_frames[panel] = frame_id
+
+    def forget_panels(self):
+        """
+        Sends every panel again on the next frame.
+        """
+        self.acked_panels.clear()
+
+    def stats(self) -> dict:
+        return {
+            "endpoint": f"{self.host}:{self.port}",
+            "healthy": self.healthy,
+            "sent": self.sent + (0 if self.stream is None else self.stream.written),
+            "lost": self.lost + (0 if self.stream is None else self.stream.lost),
+            "skipped": self.skipped,
+            "last_error": self.last_error,
+            "clock_offset": self.offset,
+            "round_trip": self.round_trip,
+            "lateness": self.lateness,
+            "panels_skipped": self.panels_skipped,
+            "connected": None if self.stream is None else self.stream.connected,
+            "dropped_stale": 0 if self.stream is None else self.stream.dropped,
+        }
+
+
+def encode_frame(led_levels: np.ndarray, wire_format: str = "json", depth: int = COLOR_DEPTH) -> bytes:
+    """
+    Encodes the integer level (0 to 2^depth - 1) of each LED for the controller.
+    - "json" sends a SCREEN_SIZE x SCREEN_SIZE list of levels out of 2^COLOR_DEPTH - 1, pixels without LEDs being 0.
+    - "binary" sends BINARY_MAGIC, the number of bit planes, then each bit plane packed in LED order, most significant first.
+    """
+    if wire_format == "json":
+        levels = np.asarray(led_levels, dtype=int) * ((2**COLOR_DEPTH - 1) // (2**depth - 1))
+        return json.dumps(CROSS.to_image(levels).astype(int).tolist()).encode()
+    if wire_format == "binary":
+        planes = [np.packbits((led_levels >> bit) & 1) for bit in reversed(range(depth))]
+        return BINARY_MAGIC + bytes([depth]) + b"".join(plane.tobytes() for plane in planes)
+    raise ValueError(f"Unknown wire format {wire_format!r}, expected one of {WIRE_FORMATS}")
+
+
+def encode_image(frame: np.ndarray, wire_format: str = "json", color_scale: bool = True) -> bytes:
+    """
+    Encodes a SCREEN_SIZE x SCREEN_SIZE frame of values between 0.0 and 1.0 for the controller, see `encode_frame`.
+    The JSON format holds every pixel of the frame, LED or not, as the controllers always received.
+    """
+    if wire_format == "json":
+        # Range 0.0-1.0 to 0-2^N-1
+        return json.dumps(np.round(frame * (2 ** COLOR_DEPTH - 1)).astype(int).tolist()).encode()
+    leds = CROSS.to_leds(frame)
+    if color_scale:
+        return encode_frame(np.round(leds * (2 ** COLOR_DEPTH - 1)).astype(np.uint8), wire_format)
+    return BINARY_MAGIC + b"\x01" + np.packbits(leds > 0.5).tobytes()
+
+
+def stamp_frame(payload: bytes, present_at: float) -> bytes:
+    """
+    Adds the time at which the controller should display an encoded frame, in the controller clock (in s).
+    - Binary frames start with TIMED_MAGIC instead of BINARY_MAGIC, the presentation time following the number of planes.
+    - JSON frames become {"present_at": time, "frame": [...]}.
+    """
+    if payload.startswith(BINARY_MAGIC):
+        return TIMED_MAGIC + payload[2:3] + struct.pack(">d", present_at) + payload[3:]
+    return b'{"present_at": ' + repr(present_at).encode() + b', "frame": ' + payload + b"}"
+
+
+def sync_request(sent_at: float) -> bytes:
+    return SYNC_MAGIC + struct.pack(">d", sent_at)
+
+
+def sync_reply(request: bytes, received_at: float, replied_at: float, lateness: Optional[float] = None) -> bytes:
+    """
+    Answer of a controller to `sync_request`, with its clock readings and how late it showed its last timed frame.
+    Raises ValueError for a malformed request.
+    """
+    if len(request) != 10:
+        raise ValueError(f"Invalid sync request of {len(request)} bytes")
+    (sent_at,) = struct.unpack(">d", request[2:10])
+    lateness = float("nan") if lateness is None else lateness
+    return SYNC_MAGIC + struct.pack(">dddd", sent_at, received_at, replied_at, lateness)
+
+
+def encode_panels(led_levels: np.ndarray, depth: int = COLOR_DEPTH, geometry: CrossGeometry = CROSS) -> List[bytes]:
+    """
+    Packs the levels (0 to 2^depth - 1) of the LEDs of each panel into bit planes, most significant first.
+    Use `panel_packet` to turn them into self-contained datagrams, well below a 1500 bytes MTU (104 bytes for 3 planes).
+    """
+    panel_levels = np.asarray(led_levels)[geometry.panel_leds]
+    planes = np.stack([np.packbits((panel_levels >> bit) & 1, axis=-1) for bit in reversed(range(depth))], axis=1)
+    return [panel.tobytes() for panel in planes]
+
+
+def panel_packet(frame_id: int, panel: int, depth: int, data: bytes) -> bytes:
+    return PANEL_MAGIC + struct.pack(">IBB", frame_id % 2**32, panel, depth) + data
+
+
+def decode_panel_packet(payload: bytes, geometry: CrossGeometry = CROSS):
+    """
+    Returns the frame id, the panel index, the LED indices of the panel and the levels of its LEDs
+    (0 to 2^COLOR_DEPTH - 1), to be applied right away. Raises ValueError for malformed packets.
+    """
+    if len(payload) < 8:
+        raise ValueError(f"Invalid panel packet of {len(payload)} bytes")
+    frame_id, panel, depth = struct.unpack(">IBB", payload[2:8])
+    panel_leds = geometry.panel_size**2
+    if panel >= len(geometry.panels) or not 1 <= depth <= COLOR_DEPTH or len(payload) != 8 + depth * panel_leds // 8:
+        raise ValueError(f"Invalid panel packet of {len(payload)} bytes")
+    planes = np.frombuffer(payload, dtype=np.uint8, offset=8).reshape(depth, -1)
+    bits = np.unpackbits(planes, axis=1)
+    levels = (bits << np.arange(depth - 1, -1, -1, dtype=np.uint8)[:, None]).sum(axis=0, dtype=np.uint8)
+    return frame_id, panel, geometry.panel_leds[panel], levels * np.uint8((2 ** COLOR_DEPTH - 1) // (2**depth - 1))
+
+
+def panel_ack(frame_id: int, panel: int) -> bytes:
+    return PANEL_ACK_MAGIC + struct.pack(">IB", frame_id % 2**32, panel)
+
+
+def is_newer_frame(frame_id: int, last_id: Optional[int]) -> bool:
+    """
+    Whether a panel packet or ack of `frame_id` may replace the one of `last_id`, frame ids wrapping around at 2^32.
+    Only ids up to STALE_FRAMES behind `last_id` are older, a larger gap meaning that the sender started over.
+    """
+    return last_id is None or not 0 < (last_id - frame_id) % 2**32 <= STALE_FRAMES
+
+
+def sequence_frame(payload: bytes, frame_id: int, sent_at: float) -> bytes:
+    """
+    Wraps an encoded frame with its frame id and send time (in s, sender clock),
+    so that a receiver can measure loss, reordering and jitter.
+    """
+    return SEQUENCE_MAGIC + struct.pack(">Id", frame_id % 2**32, sent_at) + payload
+
+
+class DecodedFrame:
+    def __init__(self, leds: np.ndarray, present_at: Optional[float] = None, frame_id: Optional[int] = None, sent_at: Optional[float] = None):
+        """
+        A frame received by a controller.
+        Attributes:
+            - `leds` holds the level of each LED, from 0 to 2^COLOR_DEPTH - 1.
+            - `present_at` is the presentation time of timed frames, in the receiver clock.
+            - `frame_id` and `sent_at` are set for sequenced frames.
+        """
+        self.leds = leds
+        self.present_at = present_at
+        self.frame_id = frame_id
+        self.sent_at = sent_at
+
+    def to_image(self) -> np.ndarray:
+        return CROSS.to_image(self.leds / (2 ** COLOR_DEPTH - 1))
+
+
+def decode_frame(payload: bytes) -> DecodedFrame:
+    """
+    Decodes any frame sent by `PharmaScreen`: JSON or binary, timed or not, sequenced or not.
+    Raises ValueError for malformed packets.
+    """
+    frame_id = sent_at = present_at = None
+    if payload.startswith(SEQUENCE_MAGIC):
+        if len(payload) < 14:
+            raise ValueError(f"Invalid sequenced frame of {len(payload)} bytes")
+        frame_id, sent_at = struct.unpack(">Id", payload[2:14])
+        payload = payload[14:]
+
+    if payload.startswith(TIMED_MAGIC):
+        if len(payload) < 11:
+            raise ValueError(f"Invalid timed frame of {len(payload)} bytes")
+        (present_at,) = struct.unpack(">d", payload[3:11])
+        payload = BINARY_MAGIC + payload[2:3] + payload[11:]
+
+    if payload.startswith(BINARY_MAGIC):
+        depth = payload[2] if len(payload) > 2 else 0
+        plane_size = -(-CROSS.n_leds // 8)
+        if not 1 <= depth <= COLOR_DEPTH or len(payload) != 3 + depth * plane_size:
+            raise ValueError(f"Invalid binary frame of {len(payload)} bytes")
+        planes = np.frombuffer(payload, dtype=np.uint8, offset=3).reshape(depth, plane_size)
+        bits = np.unpackbits(planes, axis=1, count=CROSS.n_leds)
+        # Most significant plane first
+        levels = (bits << np.arange(depth - 1, -1, -1, dtype=np.uint8)[:, None]).sum(axis=0, dtype=np.uint8)
+        leds = levels * np.uint8((2 ** COLOR_DEPTH - 1) // (2 ** depth - 1))
+    else:
+        message = json.loads(payload)
+        if isinstance(message, dict):
+            present_at, message = message["present_at"], message["frame"]
+        grid = np.asarray(message)
+        if grid.shape != (SCREEN_SIZE, SCREEN_SIZE):
+            raise ValueError(f"Invalid JSON frame of shape {grid.shape}")
+        # Checked before the conversion to uint8, which would wrap out of range levels around
+        if not np.issubdtype(grid.dtype, np.integer) or grid.min() < 0 or grid.max() > 2 ** COLOR_DEPTH - 1:
+            raise ValueError(f"Invalid JSON frame, levels must be integers from 0 to {2 ** COLOR_DEPTH - 1}")
+        leds = CROSS.to_leds(grid).astype(np.uint8)
+
+    return DecodedFrame(leds, present_at, frame_id, sent_at)
+
+
+class PresentationQueue:
+    def __init__(self, clock=time.monotonic):
+        """
+        Receiver side of synchronized presentation: holds timed frames until their presentation time.
+        Args:
+            - `clock` returns the current time of the receiver, in seconds.
+        """
+        self.clock = clock
+        self.heap = []
+        self.count = 0
+        self.dropped = 0  # Frames replaced by a later frame before being shown
+        self.lateness = None  # Time between the presentation time and the actual display of the last frame
+
+    def push(self, present_at: float, frame):
+        heapq.heappush(self.heap, (present_at, self.count, frame))
+        self.count += 1
+
+    def next_time(self) -> Optional[float]:
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self):
+        """
+        Returns the latest frame whose presentation time has passed, or None. Older due frames are dropped.
+        """
+        now = self.clock()
+        due = None
+        while self.heap and self.heap[0][0] <= now:
+            if due is not None:
+                self.dropped += 1
+            due = heapq.heappop(self.heap)
+        if due is None:
+            return None
+        self.lateness = now - due[0]
+        return due[2]
+
+
+def frame_deadline(scheduled: Optional[float], period: float, now: float) -> float:
+    """
+    Time to wait for before showing the next frame, given when it was scheduled (None for the first frame).
+    A caller more than a `period` behind starts over from `now` rather than rushing to catch up.
+    The following frame is scheduled `period` after the returned deadline.
+    """
+    if scheduled is None or now - scheduled > period:
+        return now
+    return scheduled
 
 
 class PharmaScreen:
-    def __init__(self, color_scale=True, server_ip='192.168.10.10'):
+    controller_class = Controller
+
+    def __init__(
+        self,
+        color_scale=True,
+        server_ip='192.168.10.10',
+        n_buffers=2,
+        wire_format=None,
+        ordered_dither=False,
+        calibration=None,
+        presentation_delay=None,
+        transport="udp",
+        heartbeat=HEARTBEAT_INTERVAL,
+    ):
         """
         An object representing the pharmacy cross screen for local simulation and remote control of the actual cross.
         Args:
             - `color_scale` enables up to 8 shades of green to be displayed, but reduces the expected framerate from 60 to 20FPS.
+              With "auto", the mode follows the frames: 2 colors while they have no mid-tones, 8 colors otherwise.
+              With "dither", each frame is shown as DITHER_SUBFRAMES black/green sub-frames at 60FPS, see `set_dithered`.
+            - `ordered_dither` adds a Bayer pattern to the thresholds of the dither mode, so neighbouring LEDs blink out of phase.
+            - `calibration` is a `Calibration`, or the path of a calibration file, applied to every frame before quantization.
+              Only in 8 colors and dither modes: 2 color frames are shown as they are, on or off.
+            - `presentation_delay` (in s) enables synchronized presentation: each frame tells the controllers to display it
+              this long after it was sent, using clock offsets estimated with sync requests. Must exceed the network latency.
+            - `transport` is "udp", or "tcp" for reliable and ordered delivery, see `StreamConnection`.
+              TCP only carries whole frames, without presentation time.
+            - `heartbeat` (in s): frames identical to the last one sent are skipped, unless it was sent this long ago.
+              The controllers keep receiving the current frame, and recover from a lost packet. 0 sends every frame.
             - `server_ip` is the address of the controller where update packets should be transmitted. If None, the screen is only simulated locally.
+              A list (or tuple) of controllers can be given to mirror the frames on several crosses, see `Controller`
+              for the accepted formats. A (str, int) tuple is a single controller.
+            - `n_buffers` is the number of framebuffers handed out in turn by `acquire`.
+            - `wire_format` is the encoding of the frames sent to the controller, see `encode_frame`.
+              Defaults to "json", or "binary" in dither mode, whose 3 sub-frames would triple the bandwidth in JSON.
+              "panels" sends each panel in its own datagram, skipping the panels the controller already has, see `send_panels`.
         """
+        if wire_format is None:
+            wire_format = "binary" if color_scale == "dither" else "json"
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"Unknown wire format {wire_format!r}, expected one of {WIRE_FORMATS}")
+        if color_scale == "dither" and wire_format == "json":
+            raise ValueError("The dither mode sends 3 frames per frame, it needs the binary or panels wire format")
+        self.wire_format = wire_format
+        if isinstance(calibration, str):
+            calibration = Calibration.load(calibration)
+        self.calibration = calibration
         self.server_ip = server_ip
-        if server_ip is not None:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            #self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            #self.socket.connect(('192.168.1.107', 1337))
-            #print('Socket connected')
-        self.color_scale = color_scale
+        if server_ip is None:
+            endpoints = []
+        elif isinstance(server_ip, str) or is_endpoint_tuple(server_ip):
+            endpoints = [server_ip]
+        else:
+            endpoints = list(server_ip)
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport {transport!r}, expected one of {TRANSPORTS}")
+        if transport == "tcp" and (wire_format == "panels" or presentation_delay is not None):
+            raise ValueError("The TCP transport only carries whole frames, without presentation time")
+        self.transport = transport
+        self.controllers = [self.controller_class(endpoint, transport) for endpoint in endpoints]
+        self.presentation_delay = presentation_delay
+        # Random start, so that a controller does not take the first panels of a restarted module for stale ones
+        self.frame_id = int.from_bytes(os.urandom(4), "big")
+        self.heartbeat = heartbeat
+        self.last_sent_hash = None
+        self.last_sent_time = 0.0
+        self.suppressed_frames = 0
+        self.auto_color = color_scale == "auto"
+        self.dither = color_scale == "dither"
+        self.color_scale = True if self.auto_color else color_scale
+        if self.dither:
+            self.color_scale = False
+            # Brightness owed to each LED by the previous sub-frames
+            self.dither_error = np.zeros(CROSS.n_leds)
+            # Threshold of each LED for each sub-frame, the Bayer pattern shifting from one sub-frame to the next
+            if ordered_dither:
+                bayer = CROSS.to_leds(np.tile(BAYER_4X4, (SCREEN_SIZE // 4, SCREEN_SIZE // 4)))
+                self.dither_thresholds = [(bayer + k / DITHER_SUBFRAMES) % 1.0 for k in range(DITHER_SUBFRAMES)]
+            else:
+                self.dither_thresholds = [np.full(CROSS.n_leds, 0.5)] * DITHER_SUBFRAMES
+            self.next_subframe_time = None
+        # Consecutive frames that disagree with the current mode, for the hysteresis of the auto mode
+        self.mode_streak = 0
+        self.mode_switches = 0
         self.local_screen = pygame.display.set_mode(
             [PIXEL_SIZE * SCREEN_SIZE, PIXEL_SIZE * SCREEN_SIZE]
         )
         self.pixel_buffer = [
             [0.0 for c in range(SCREEN_SIZE)] for r in range(SCREEN_SIZE)
         ]
+        self.framebuffers = [np.zeros((SCREEN_SIZE, SCREEN_SIZE)) for _ in range(n_buffers)]
+        self.back_index = 0
         self.clock = pygame.time.Clock()
+        self.frame_start = None
         self.fps = FPS_8COLOR if color_scale else FPS_2COLOR
         self.font = pygame.font.SysFont(None, 24)
 
@@ -43,14 +962,36 @@ class PharmaScreen:
         """
         Returns whether the given coordinates match an actual LED on the screen.
         """
-        if not (0 <= row < SCREEN_SIZE and 0 <= col < SCREEN_SIZE):
-            return False
+        return CROSS.is_drawable(row, col)
 
-        panel_coords = (
-            row // PANEL_SIZE,
-            col // PANEL_SIZE,
-        )  # Locate the target on the 3x3 grid of panels
-        return panel_coords in ((0, 1), (1, 0), (1, 1), (1, 2), (2, 1))
+    @property
+    def front_buffer(self) -> np.ndarray:
+        """
+        The framebuffer presented last.
+        """
+        return self.framebuffers[self.back_index - 1]
+
+    def acquire(self, clear: bool = True, copy_previous: bool = False) -> np.ndarray:
+        """
+        Returns the next framebuffer to draw into, to be shown with `present`.
+        The buffers are reused from one frame to the next, so no memory is allocated in the main loop.
+        Args:
+            - `clear` sets the buffer to 0.0, otherwise it holds the frame presented `n_buffers` frames ago.
+            - `copy_previous` fills the buffer with the last presented frame instead, for incremental drawing.
+        """
+        back = self.framebuffers[self.back_index]
+        if copy_previous:
+            np.copyto(back, self.front_buffer)
+        elif clear:
+            back.fill(0.0)
+        return back
+
+    def present(self):
+        """
+        Displays the buffer returned by `acquire`, and swaps to the next buffer.
+        """
+        self.set_image(self.framebuffers[self.back_index])
+        self.back_index = (self.back_index + 1) % len(self.framebuffers)
 
     def set_image(self, image: List[List[float]]):
         """
@@ -59,42 +1000,403 @@ class PharmaScreen:
         The `image` argument should be an array of floats representing the pixels in (row, column) order.
         Values range from 0.0 (off) to 1.0 (brightest).
         Note that 4 sections of the image will be ignored as the screen is a cross.
+        A `CrossBuffer` or a `BitFrame` can also be given.
         """
-        if len(image) != SCREEN_SIZE or any(len(row) != SCREEN_SIZE for row in image):
+        if isinstance(image, BitFrame):
+            if self.auto_color:
+                self.update_color_mode(has_midtones=False)
+            return self.set_bitframe(image)
+        if isinstance(image, CrossBuffer):
+            image = image.to_image()
+        frame = np.asarray(image, dtype=float)
+        if frame.shape != (SCREEN_SIZE, SCREEN_SIZE):
             raise ValueError(
                 f"Invalid image size (expected {SCREEN_SIZE}x{SCREEN_SIZE})"
             )
+        if not (0.0 <= frame.min() and frame.max() <= 1.0):
+            raise ValueError("Pixel values should be between 0.0 and 1.0")
+
+        leds = CROSS.to_leds(frame)
+        if self.auto_color:
+            levels = np.round(leds * (2 ** COLOR_DEPTH - 1)).astype(np.intp)
+            histogram = np.bincount(levels, minlength=2 ** COLOR_DEPTH)
+            self.update_color_mode(has_midtones=bool(histogram[1:-1].any()))
+        if self.calibration is not None and (self.color_scale or self.dither):
+            # In 2 colors, a gain below 0.5 would switch the LEDs off rather than dim them
+            leds = self.calibration.apply(leds)
+            frame = CROSS.to_image(leds)
+        if self.dither:
+            return self.set_dithered(leds)
+        quantizer = 7 if self.color_scale else 1
+        self.draw_leds((np.round(leds * quantizer) / quantizer).tolist())
+
+        if self.controllers:
+            # Content of the packet: every pixel with the JSON format, only the LEDs otherwise
+            depth = COLOR_DEPTH if self.color_scale or self.wire_format == "json" else 1
+            levels = np.round((frame if self.wire_format == "json" else leds) * (2**depth - 1)).astype(np.uint8)
+            content_hash = hash((depth, levels.tobytes()))
+            heartbeat = content_hash == self.last_sent_hash
+            if self.should_send(content_hash):
+                if self.wire_format == "panels":
+                    # Acknowledged panels are skipped, a heartbeat sends them all
+                    self.send_panels(levels, depth, refresh=heartbeat)
+                else:
+                    self.send_frame(encode_image(frame, self.wire_format, self.color_scale))
+
+        self.end_frame()
+
+    def set_bitframe(self, frame: BitFrame):
+        """
+        Displays a black/green frame. In the binary wire format, its bits are sent without any conversion.
+        """
+        leds = frame.to_leds()
+        self.draw_leds(leds.tolist())
+
+        content_hash = hash((1, frame.to_bytes()))
+        heartbeat = content_hash == self.last_sent_hash
+        if self.controllers and self.should_send(content_hash):
+            if self.wire_format == "binary":
+                self.send_frame(BINARY_MAGIC + b"\x01" + frame.to_bytes())
+            elif self.wire_format == "panels":
+                self.send_panels(leds.astype(np.uint8), depth=1, refresh=heartbeat)
+            else:
+                self.send_frame(encode_frame(leds.astype(np.uint8), self.wire_format, depth=1))
+
+        self.end_frame()
+
+    def set_dithered(self, leds: np.ndarray):
+        """
+        Shows the brightness of each LED as DITHER_SUBFRAMES black/green sub-frames at 60FPS.
+        Each LED turns on when its value plus the error carried from the previous sub-frames exceeds its threshold,
+        so gradients average out to more than 8 perceived levels. In the binary format, the 3 bit planes sent per frame
+        weigh as much as a single 3 bit frame.
+        """
+        for subframe in self.dither_subframes(leds):
+            self.wait_next_subframe()
+            self.set_bitframe(subframe)
+
+    def dither_subframes(self, leds: np.ndarray):
+        """
+        Yields the BitFrames of the sub-frames, updating the error carried by each LED.
+        """
+        for thresholds in self.dither_thresholds:
+            values = leds + self.dither_error
+            bits = values > thresholds
+            self.dither_error = values - bits
+            yield BitFrame.from_leds(bits)
+
+    def wait_next_subframe(self):
+        """
+        Waits for the deadline of the next sub-frame, finishing with a busy-wait to keep a steady 60FPS.
+        """
+        period = 1 / FPS_2COLOR
+        deadline = frame_deadline(self.next_subframe_time, period, time.perf_counter())
+        self.wait_until(deadline - SPIN_TIME)
+        while time.perf_counter() < deadline:
+            pass
+        self.next_subframe_time = deadline + period
+
+    def update_color_mode(self, has_midtones: bool):
+        """
+        Switches between 2 and 8 colors once enough consecutive frames call for the other mode.
+        The controller follows from the frames themselves: 2 color frames only hold levels 0 and 7 in JSON,
+        and a single bit plane in the binary format.
+        """
+        if has_midtones != self.color_scale:
+            self.mode_streak += 1
+        else:
+            self.mode_streak = 0
+
+        if self.mode_streak >= (AUTO_8COLOR_FRAMES if has_midtones else AUTO_2COLOR_FRAMES):
+            self.color_scale = has_midtones
+            self.fps = FPS_8COLOR if has_midtones else FPS_2COLOR
+            self.mode_streak = 0
+            self.mode_switches += 1
+
+    def metrics(self) -> dict:
+        """
+        Current state of the screen, for monitoring.
+        """
+        return {
+            "color_mode": "dither" if self.dither else "8color" if self.color_scale else "2color",
+            "auto_color": self.auto_color,
+            "mode_switches": self.mode_switches,
+            "target_fps": self.fps,
+            "effective_fps": self.clock.get_fps(),
+            "controllers": [controller.stats() for controller in self.controllers],
+            "skew": self.skew(),
+            "suppressed_frames": self.suppressed_frames,
+        }
 
+    def skew(self) -> Optional[float]:
+        """
+        Spread (in s) between the controllers of the lateness of their last displayed frame, None until 2 of them reported it.
+        """
+        lateness = [controller.lateness for controller in self.controllers if controller.lateness is not None]
+        return max(lateness) - min(lateness) if len(lateness) >= 2 else None
+
+    def draw_leds(self, led_values: List[float]):
+        """
+        Draws the simulated cross, from the quantized value of each LED.
+        """
         self.local_screen.fill((0, 0, 0))
-        for r, c in itertools.product(range(SCREEN_SIZE), repeat=2):
-            if not 0.0 <= image[r][c] <= 1.0:
-                raise ValueError("Pixel values should be between 0.0 and 1.0")
-
-            if self.is_drawable(r, c):
-                quantizer = 7 if self.color_scale else 1
-                quantized_color = round(image[r][c] * quantizer) / quantizer
-
-                led_color = (30, 30 + GREEN_BRIGHTNESS * quantized_color, 30)
-                center = (PIXEL_SIZE * (c + 0.5), PIXEL_SIZE * (r + 0.5))
-                pygame.draw.circle(
-                    self.local_screen,
-                    led_color,
-                    center,
-                    PIXEL_SIZE * PIXEL_RADIUS_RATIO / 2,
-                )
-
-        if self.server_ip is not None:
-            # Range 0.0-1.0 to 0-2^N-1
-            quantized_frame = [[round(pix * (2 ** COLOR_DEPTH - 1)) for pix in row] for row in image]
-            frameenc = json.dumps(quantized_frame).encode()
-            #print(len(frameenc))
-            #self.socket.sendall(frameenc)
-            self.socket.sendto(frameenc, (self.server_ip, 1337))
-            print('Frame sent')
+        for (r, c), value in zip(CROSS.led_coords, led_values):
+            led_color = (30, 30 + GREEN_BRIGHTNESS * value, 30)
+            center = (PIXEL_SIZE * (c + 0.5), PIXEL_SIZE * (r + 0.5))
+            pygame.draw.circle(
+                self.local_screen,
+                led_color,
+                center,
+                PIXEL_SIZE * PIXEL_RADIUS_RATIO / 2,
+            )
+
+    def send_frame(self, frameenc: bytes):
+        """
+        Sends an encoded frame to every controller. The frame is encoded once, whatever the number of controllers.
+        """
+        #print(len(frameenc))
+        if self.presentation_delay is None:
+            for controller in self.controllers:
+                controller.send(frameenc)
+        else:
+            present_at = time.monotonic() + self.presentation_delay
+            for controller in self.controllers:
+                # Without a clock offset yet, the controller shows the frame on arrival
+                if controller.offset is None:
+                    controller.send(frameenc)
+                else:
+                    controller.send(stamp_frame(frameenc, present_at + controller.offset))
+        print('Frame sent')
+
+    def should_send(self, content_hash: int) -> bool:
+        """
+        Whether a frame must be sent, i.e. its content changed or the heartbeat is due.
+        """
+        now = time.monotonic()
+        if content_hash == self.last_sent_hash and now - self.last_sent_time < self.heartbeat:
+            self.suppressed_frames += 1
+            return False
+        self.last_sent_hash = content_hash
+        self.last_sent_time = now
+        return True
 
+    def send_panels(self, led_levels: np.ndarray, depth: int, refresh: bool = False):
+        """
+        Sends each panel in its own datagram, so a lost packet only loses one panel.
+        Panels whose content was already acknowledged by a controller are not sent to it again, unless `refresh` is set.
+        """
+        self.read_replies()
+        self.frame_id += 1
+        if refresh or self.frame_id % KEYFRAME_INTERVAL == 0:
+            for controller in self.controllers:
+                controller.forget_panels()
+
+        for panel, data in enumerate(encode_panels(led_levels, depth)):
+            packet = None
+            for controller in self.controllers:
+                if controller.needs_panel(panel, data):
+                    packet = packet or panel_packet(self.frame_id, panel, depth, data)
+                    controller.send(packet)
+                    controller.sent_panel(self.frame_id, panel, data)
+
+    def read_replies(self):
+        """
+        Handles the packets sent back by the controllers: clock synchronization replies and panel acknowledgements.
+        """
+        for controller in self.controllers:
+            for reply, arrived_at in controller.receive():
+                self.handle_reply(reply, controller, arrived_at)
+
+    def handle_reply(self, reply: bytes, controller: Controller, arrived_at: float):
+        """
+        Handles a reply of `controller`, received at `arrived_at` (time.monotonic).
+        """
+        if reply.startswith(SYNC_MAGIC) and len(reply) == 34:
+            sent_at, received_at, replied_at, lateness = struct.unpack(">dddd", reply[2:])
+            controller.add_clock_sample(sent_at, received_at, replied_at, arrived_at, lateness)
+        elif reply.startswith(PANEL_ACK_MAGIC) and len(reply) == 7:
+            controller.ack_panel(*struct.unpack(">IB", reply[2:]))
 
+    def synchronize_clocks(self):
+        """
+        Reads the pending sync replies, and sends a new sync request to the controllers that are due for one.
+        """
+        self.read_replies()
+        now = time.monotonic()
+        for controller in self.controllers:
+            if controller.last_sync is None or now - controller.last_sync >= SYNC_INTERVAL:
+                controller.last_sync = now
+                controller.send(sync_request(now))
+
+    def end_frame(self):
         current_fps = self.clock.get_fps()
-        fps_img = self.font.render(f"FPS: {current_fps:.1f}", True, (0, 100, 0))
+        mode = f" ({8 if self.color_scale else 2} colors)" if self.auto_color else ""
+        fps_img = self.font.render(f"FPS: {current_fps:.1f}{mode}", True, (0, 100, 0))
         self.local_screen.blit(fps_img, (0, 0))
         pygame.display.flip()
-        self.frame_timing = self.clock.tick(self.fps)
+        for controller in self.controllers:
+            controller.end_frame()
+        if self.presentation_delay is not None:
+            # Right before waiting for the next frame, so that the replies are read as soon as they arrive
+            self.synchronize_clocks()
+        self.frame_timing = self.wait_frame()
+
+    def wait_frame(self) -> int:
+        """
+        Waits for the end of the frame, returns the time since the previous frame (in ms).
+        """
+        # Sub-frames are paced by wait_next_subframe
+        if self.dither:
+            return self.clock.tick()
+        if self.controllers and self.frame_start is not None:
+            # Most of the frame is spent here, the replies are read as they arrive rather than on the next frame
+            self.wait_until(self.frame_start + 1 / self.fps)
+        frame_timing = self.clock.tick(self.fps)
+        self.frame_start = time.perf_counter()
+        return frame_timing
+
+    def wait_until(self, deadline: float):
+        """
+        Sleeps until `deadline` (time.perf_counter), handling the replies of the controllers as soon as they arrive,
+        so that the round trip of the clock synchronization does not include the wait for the next frame.
+        Frames waiting on a TCP connection are written as soon as it accepts them.
+        """
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            readers = [controller.socket for controller in self.controllers if controller.socket is not None]
+            streams = {
+                controller.stream.socket: controller
+                for controller in self.controllers
+                if controller.stream is not None and controller.stream.pending
+            }
+            if not readers and not streams:
+                time.sleep(remaining)
+                return
+            readable, writable, _ = select.select(readers, list(streams), [], remaining)
+            if readable:
+                self.read_replies()
+            for sock in writable:
+                streams[sock].flush()
+
+
+def blit(
+    image: np.ndarray,
+    values: np.ndarray,
+    mask: Optional[np.ndarray],
+    y: int,
+    x: int,
+    blend: str = "replace",
+):
+    """
+    Draws `values` into `image` with the top left corner at (y, x), only where `mask` is set (everywhere if None).
+    Parts falling outside of the image are clipped.
+    `blend` selects how values are combined with the image: "replace", "max", "add" (saturating) or "multiply".
+    """
+    h, w = values.shape
+    top, left = max(y, 0), max(x, 0)
+    bottom, right = min(y + h, image.shape[0]), min(x + w, image.shape[1])
+    if bottom <= top or right <= left:
+        return
+
+    window = (slice(top - y, bottom - y), slice(left - x, right - x))
+    dst = image[top:bottom, left:right]
+    src = values[window]
+    where = True if mask is None else mask[window]
+    if blend == "replace":
+        np.copyto(dst, src, where=where)
+    elif blend == "max":
+        np.maximum(dst, src, out=dst, where=where)
+    elif blend == "add":
+        np.add(dst, src, out=dst, where=where)
+        np.minimum(dst, 1.0, out=dst)
+    elif blend == "multiply":
+        np.multiply(dst, src, out=dst, where=where)
+    else:
+        raise ValueError(f"Unknown blend mode {blend!r}, expected one of {BLEND_MODES}")
+
+
+class Sprite:
+    def __init__(
+        self,
+        pixels,
+        y: float = 0,
+        x: float = 0,
+        brightness: float = 1.0,
+        blend: str = "replace",
+        mask=None,
+        visible: bool = True,
+    ):
+        """
+        An image drawn by a `Compositor` at a given position.
+        Args:
+            - `pixels` is a 2D array of floats between 0.0 and 1.0, it can be larger than the screen (e.g. a background layer).
+            - `y` and `x` are the coordinates of the top left corner, rounded down when drawing.
+            - `brightness` scales the pixel values.
+            - `blend` is one of `BLEND_MODES`.
+            - `mask` is a boolean array of the same shape as `pixels` marking the opaque pixels. If None, the sprite is a full rectangle.
+        """
+        if blend not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode {blend!r}, expected one of {BLEND_MODES}")
+        self.pixels = np.asarray(pixels, dtype=float)
+        self.mask = None if mask is None else np.asarray(mask, dtype=bool)
+        self.y = y
+        self.x = x
+        self.brightness = brightness
+        self.blend = blend
+        self.visible = visible
+
+    @classmethod
+    def from_mask(cls, mask, value: float = 1.0, **kwargs) -> "Sprite":
+        """
+        Creates a sprite of a single color, opaque where `mask` is set.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        return cls(np.full(mask.shape, value), mask=mask, **kwargs)
+
+    def draw(self, image: np.ndarray):
+        pixels = self.pixels if self.brightness == 1.0 else self.pixels * self.brightness
+        blit(image, pixels, self.mask, int(np.floor(self.y)), int(np.floor(self.x)), self.blend)
+
+
+class Compositor:
+    def __init__(self, background=None, clip_to_cross: bool = True):
+        """
+        Draws an ordered list of sprites into a framebuffer that is reused from one frame to the next.
+        Args:
+            - `background` is an optional SCREEN_SIZE x SCREEN_SIZE array copied into the frame before the sprites.
+            - `clip_to_cross` sets the pixels without LEDs to 0.0, so the frame matches what the cross shows.
+        """
+        self.frame = np.zeros((SCREEN_SIZE, SCREEN_SIZE))
+        self.background = None if background is None else np.asarray(background, dtype=float)
+        self.clip_to_cross = clip_to_cross
+        self.sprites: List[Sprite] = []
+
+    def add(self, sprite: Sprite) -> Sprite:
+        """
+        Adds a sprite on top of the others, and returns it.
+        """
+        self.sprites.append(sprite)
+        return sprite
+
+    def remove(self, sprite: Sprite):
+        self.sprites.remove(sprite)
+
+    def compose(self) -> np.ndarray:
+        """
+        Draws the background and the visible sprites, and returns the framebuffer.
+        The returned array is overwritten by the next call.
+        """
+        if self.background is None:
+            self.frame.fill(0.0)
+        else:
+            np.copyto(self.frame, self.background)
+
+        for sprite in self.sprites:
+            if sprite.visible:
+                sprite.draw(self.frame)
+
+        if self.clip_to_cross:
+            np.multiply(self.frame, CROSS_MASK, out=self.frame)
+        return self.frame
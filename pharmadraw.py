@@ -0,0 +1,198 @@
+"""
+Drawing primitives for the cross, computed as array operations.
+
+Every shape function returns a read-only SCREEN_SIZE x SCREEN_SIZE coverage array (0.0 to 1.0)
+in (row, column) order, clipped to the LEDs of the cross unless `clip=False`.
+Results are cached by arguments, so static shapes are only rasterized once.
+Use `draw` to paint a coverage array into an image.
+"""
+
+import functools
+from typing import Tuple
+
+import numpy as np
+
+from pharmacontroller import COLOR_DEPTH, CROSS_MASK, SCREEN_SIZE, blit
+
+LEVELS = 2**COLOR_DEPTH  # Shades of green shown by the cross in color_scale mode
+CACHE_SIZE = 256
+
+# Coordinates of every pixel, shared by all the primitives
+ROWS, COLS = np.mgrid[0:SCREEN_SIZE, 0:SCREEN_SIZE]
+
+
+def quantize(coverage: np.ndarray, levels: int = LEVELS) -> np.ndarray:
+    """
+    Rounds coverage values to the `levels` shades the cross can show.
+    """
+    return np.round(coverage * (levels - 1)) / (levels - 1)
+
+
+def _finish(coverage: np.ndarray, clip: bool) -> np.ndarray:
+    if clip:
+        coverage *= CROSS_MASK
+    coverage.flags.writeable = False
+    return coverage
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def line(y0: int, x0: int, y1: int, x1: int, clip: bool = True) -> np.ndarray:
+    """
+    One pixel wide line from (y0, x0) to (y1, x1), both ends included.
+    """
+    coverage = np.zeros((SCREEN_SIZE, SCREEN_SIZE))
+    n = max(abs(y1 - y0), abs(x1 - x0)) + 1
+    t = np.linspace(0.0, 1.0, n)
+    ys = np.floor(y0 + t * (y1 - y0) + 0.5).astype(int)
+    xs = np.floor(x0 + t * (x1 - x0) + 0.5).astype(int)
+    inside = (0 <= ys) & (ys < SCREEN_SIZE) & (0 <= xs) & (xs < SCREEN_SIZE)
+    coverage[ys[inside], xs[inside]] = 1.0
+    return _finish(coverage, clip)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def wu_line(
+    y0: float, x0: float, y1: float, x1: float, levels: int = LEVELS, clip: bool = True
+) -> np.ndarray:
+    """
+    Anti-aliased line (Xiaolin Wu) between floating point coordinates, quantized to `levels` shades.
+    """
+    coverage = np.zeros((SCREEN_SIZE, SCREEN_SIZE))
+    steep = abs(y1 - y0) > abs(x1 - x0)
+    # Walk along the major axis, splitting the minor coordinate between two pixels
+    a0, b0, a1, b1 = (y0, x0, y1, x1) if steep else (x0, y0, x1, y1)
+    if a1 < a0:
+        a0, b0, a1, b1 = a1, b1, a0, b0
+    major = np.arange(int(np.floor(a0 + 0.5)), int(np.floor(a1 + 0.5)) + 1)
+    gradient = (b1 - b0) / (a1 - a0) if a1 != a0 else 0.0
+    minor = b0 + gradient * (major - a0)
+    base = np.floor(minor).astype(int)
+    frac = minor - base
+
+    for offset, weight in ((0, 1.0 - frac), (1, frac)):
+        rows, cols = (major, base + offset) if steep else (base + offset, major)
+        inside = (0 <= rows) & (rows < SCREEN_SIZE) & (0 <= cols) & (cols < SCREEN_SIZE)
+        np.maximum.at(coverage, (rows[inside], cols[inside]), weight[inside])
+
+    return _finish(quantize(coverage, levels), clip)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def disc(
+    cy: float, cx: float, radius: float, antialias: bool = False, levels: int = LEVELS, clip: bool = True
+) -> np.ndarray:
+    """
+    Filled disc of pixels whose center is within `radius` of (cy, cx).
+    """
+    dist = np.hypot(ROWS - cy, COLS - cx)
+    if antialias:
+        coverage = quantize(np.clip(radius + 0.5 - dist, 0.0, 1.0), levels)
+    else:
+        coverage = (dist <= radius).astype(float)
+    return _finish(coverage, clip)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def circle(
+    cy: float, cx: float, radius: float, antialias: bool = False, levels: int = LEVELS, clip: bool = True
+) -> np.ndarray:
+    """
+    Outline of a circle, one pixel wide.
+    """
+    distance_to_edge = np.abs(np.hypot(ROWS - cy, COLS - cx) - radius)
+    if antialias:
+        coverage = quantize(np.clip(1.0 - distance_to_edge, 0.0, 1.0), levels)
+    else:
+        coverage = (distance_to_edge < 0.5).astype(float)
+    return _finish(coverage, clip)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def diamond(cy: float, cx: float, radius: float, clip: bool = True) -> np.ndarray:
+    """
+    Filled diamond of pixels within a Manhattan distance of `radius` from (cy, cx).
+    """
+    coverage = (np.abs(ROWS - cy) + np.abs(COLS - cx) <= radius).astype(float)
+    return _finish(coverage, clip)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def rectangle(y: int, x: int, height: int, width: int, filled: bool = True, clip: bool = True) -> np.ndarray:
+    """
+    Rectangle with its top left corner at (y, x).
+    """
+    coverage = np.zeros((SCREEN_SIZE, SCREEN_SIZE))
+    area = (slice(max(y, 0), max(y + height, 0)), slice(max(x, 0), max(x + width, 0)))
+    coverage[area] = 1.0
+    if not filled and height > 2 and width > 2:
+        coverage[max(y + 1, 0) : max(y + height - 1, 0), max(x + 1, 0) : max(x + width - 1, 0)] = 0.0
+    return _finish(coverage, clip)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def polygon(points: Tuple[Tuple[float, float], ...], clip: bool = True) -> np.ndarray:
+    """
+    Filled polygon given as a tuple of (y, x) vertices. A pixel is filled when its center
+    is inside the polygon (even-odd rule) or on one of its edges.
+    """
+    ys = np.array([p[0] for p in points], dtype=float)
+    xs = np.array([p[1] for p in points], dtype=float)
+    ys_next, xs_next = np.roll(ys, -1), np.roll(xs, -1)
+
+    rows = ROWS[..., None]
+    cols = COLS[..., None]
+    # Even-odd rule: count the edges crossed by a ray going right from each pixel center
+    spans = (ys <= rows) != (ys_next <= rows)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing_x = xs + (rows - ys) * (xs_next - xs) / (ys_next - ys)
+    inside = (spans & (cols < crossing_x)).sum(axis=-1) % 2 == 1
+
+    # Pixels lying on an edge are part of the polygon
+    cross = (xs_next - xs) * (rows - ys) - (ys_next - ys) * (cols - xs)
+    length = np.hypot(xs_next - xs, ys_next - ys)
+    within = (
+        (np.minimum(ys, ys_next) - 0.5 <= rows) & (rows <= np.maximum(ys, ys_next) + 0.5)
+        & (np.minimum(xs, xs_next) - 0.5 <= cols) & (cols <= np.maximum(xs, xs_next) + 0.5)
+    )
+    on_edge = (np.abs(cross) <= 0.5 * length) & within
+
+    coverage = (inside | on_edge.any(axis=-1)).astype(float)
+    return _finish(coverage, clip)
+
+
+def triangle(p0: Tuple[float, float], p1: Tuple[float, float], p2: Tuple[float, float], clip: bool = True) -> np.ndarray:
+    return polygon((tuple(p0), tuple(p1), tuple(p2)), clip)
+
+
+def flood_fill(image: np.ndarray, y: int, x: int, tolerance: float = 0.0, clip: bool = True) -> np.ndarray:
+    """
+    Region of the pixels 4-connected to (y, x) whose value is within `tolerance` of the value at (y, x).
+    The region grows by whole-array dilations rather than pixel by pixel. Not cached as it depends on the image.
+    """
+    image = np.asarray(image, dtype=float)
+    similar = np.abs(image - image[y, x]) <= tolerance
+    if clip:
+        similar &= CROSS_MASK
+    region = np.zeros(similar.shape, dtype=bool)
+    region[y, x] = similar[y, x]
+
+    while True:
+        grown = region.copy()
+        grown[1:] |= region[:-1]
+        grown[:-1] |= region[1:]
+        grown[:, 1:] |= region[:, :-1]
+        grown[:, :-1] |= region[:, 1:]
+        grown &= similar
+        if np.array_equal(grown, region):
+            return region.astype(float)
+        region = grown
+
+
+def draw(image: np.ndarray, coverage: np.ndarray, value: float = 1.0, blend: str = "max") -> np.ndarray:
+    """
+    Paints `value`, scaled by the coverage, into the image where the coverage is not zero.
+    See pharmacontroller.blit for the blend modes.
+    """
+    blit(image, coverage * value, coverage > 0, 0, 0, blend)
+    return image
+
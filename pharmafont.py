@@ -0,0 +1,151 @@
+import functools
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from pharmacontroller import blit
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+FONTS = {
+    "large": "letters.json",  # 11 pixels high, used by textwriter
+    "small": "letters_small.json",  # 5 pixels high, used by tetris
+}
+LETTER_SPACING = 1  # Empty columns between two glyphs
+
+
+class Font:
+    def __init__(self, name: str = "large"):
+        """
+        A set of glyphs packed side by side into a single numpy atlas.
+        Args:
+            - `name` is a key of `FONTS`, or a path to a JSON file mapping each character to its matrix.
+        """
+        self.name = name
+        self.path = os.path.join(ASSETS_DIR, FONTS[name]) if name in FONTS else name
+        self.cache_path = os.path.splitext(self.path)[0] + ".npz"
+
+        chars, self.atlas, offsets, widths = self._load()
+        self.height = self.atlas.shape[0]
+        # Character -> (x offset in the atlas, width)
+        self.glyphs = {
+            c: (int(x), int(w)) for c, x, w in zip(chars, offsets, widths)
+        }
+
+    def _load(self):
+        """
+        Loads the compiled atlas next to the JSON file, or compiles it if it is missing or outdated.
+        """
+        mtime = os.path.getmtime(self.path)
+        try:
+            with np.load(self.cache_path) as cache:
+                if cache["mtime"] == mtime:
+                    return (
+                        cache["chars"].tolist(),
+                        cache["atlas"],
+                        cache["offsets"],
+                        cache["widths"],
+                    )
+        except Exception:
+            pass  # Missing, outdated or corrupt (e.g. an interrupted write): compiled again
+
+        with open(self.path, "r") as f:
+            letters = json.load(f)
+
+        chars = list(letters)
+        widths = np.array([len(letters[c][0]) for c in chars], dtype=np.int32)
+        offsets = np.concatenate(([0], np.cumsum(widths)[:-1])).astype(np.int32)
+        height = max(len(letters[c]) for c in chars)
+        atlas = np.zeros((height, int(widths.sum())), dtype=np.uint8)
+        for c, x, w in zip(chars, offsets, widths):
+            matrix = letters[c]
+            atlas[: len(matrix), x : x + w] = matrix
+
+        self._save(mtime=mtime, chars=np.array(chars), atlas=atlas, offsets=offsets, widths=widths)
+        return chars, atlas, offsets, widths
+
+    def _save(self, **arrays):
+        """
+        Writes the compiled atlas to a temporary file renamed over the cache, so that a reader never sees a partial file.
+        """
+        try:
+            fd, temp_path = tempfile.mkstemp(suffix=".npz", dir=os.path.dirname(self.cache_path))
+        except OSError:
+            return  # Read-only install, the atlas will be compiled at each startup
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            os.remove(temp_path)
+
+    def glyph(self, c: str) -> np.ndarray:
+        """
+        Returns a read-only view of the atlas for the given character.
+        """
+        x, w = self.glyphs[c]
+        return self.atlas[:, x : x + w]
+
+    def text_width(self, text: str, spacing: int = LETTER_SPACING) -> int:
+        """
+        Returns the width of the rendered text in pixels, without trailing spacing.
+        """
+        if not text:
+            return 0
+        return sum(self.glyphs[c][1] for c in text) + spacing * (len(text) - 1)
+
+    @functools.lru_cache(maxsize=256)
+    def render(self, text: str, spacing: int = LETTER_SPACING, scale: int = 1):
+        """
+        Rasterizes the text into a strip of glyph values, along with a mask of the pixels covered by a glyph
+        (the spacing between glyphs is left out of the mask).
+        Results are cached, so the arrays must not be modified.
+        """
+        missing = set(text) - self.glyphs.keys()
+        if missing:
+            raise ValueError(f"Font {self.name} has no glyph for {''.join(sorted(missing))!r}")
+
+        strip = np.zeros((self.height, self.text_width(text, spacing)), dtype=np.uint8)
+        mask = np.zeros(strip.shape, dtype=bool)
+        x = 0
+        for c in text:
+            glyph_x, w = self.glyphs[c]
+            strip[:, x : x + w] = self.atlas[:, glyph_x : glyph_x + w]
+            mask[:, x : x + w] = True
+            x += w + spacing
+
+        if scale != 1:
+            strip = strip.repeat(scale, axis=0).repeat(scale, axis=1)
+            mask = mask.repeat(scale, axis=0).repeat(scale, axis=1)
+        strip.flags.writeable = False
+        mask.flags.writeable = False
+        return strip, mask
+
+    def draw(
+        self,
+        image: np.ndarray,
+        text: str,
+        y: int,
+        x: int,
+        bright: float = 1.0,
+        scale: int = 1,
+        spacing: int = LETTER_SPACING,
+        inverted: bool = False,
+    ) -> int:
+        """
+        Draws the text with its top left corner at (y, x), clipped to the image.
+        Returns the x coordinate following the text, including the trailing spacing.
+        """
+        strip, mask = self.render(text, spacing, scale)
+        values = (1 - strip if inverted else strip) * bright
+        blit(image, values, mask, y, x)
+        return x + strip.shape[1] + spacing * scale if text else x
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(name: str = "large") -> Font:
+    """
+    Returns the shared instance of a font, loading it on first use.
+    """
+    return Font(name)
@@ -0,0 +1,175 @@
+"""
+Video wall: several crosses side by side showing a single canvas larger than SCREEN_SIZE.
+
+The canvas is a plain float array, so anything drawing into an image of any size
+(textwriter.String, pharmadraw, blit...) works on it. Each cross sees a zero-copy
+SCREEN_SIZE x SCREEN_SIZE view of the canvas, encoded and sent to its own controller in parallel.
+
+The layout is a JSON file listing the crosses and the position of their top left pixel on the canvas:
+{
+    "crosses": [
+        {"controller": "192.168.10.10", "y": 0, "x": 0},
+        {"controller": "192.168.10.11:1337", "y": 0, "x": 48, "calibration": "assets/cross2.json"}
+    ]
+}
+The canvas is sized to fit every cross, unless "height" and "width" are given.
+
+    with VideoWall("wall.json") as wall:
+        while True:
+            wall.canvas[:] = ...
+            wall.present()
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pygame
+
+from pharmacontroller import (
+    COLOR_DEPTH,
+    CROSS,
+    FPS_2COLOR,
+    FPS_8COLOR,
+    GREEN_BRIGHTNESS,
+    PIXEL_RADIUS_RATIO,
+    SCREEN_SIZE,
+    Calibration,
+    Controller,
+    encode_image,
+)
+
+WALL_WIRE_FORMATS = ("json", "binary")  # Whole frame formats, panel packets need the acknowledgements of PharmaScreen
+PREVIEW_PIXEL_SIZE = 8  # Width of each LED in the local preview, smaller than PharmaScreen's to fit several crosses
+
+
+def load_layout(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class WallCross:
+    def __init__(self, canvas: np.ndarray, y: int, x: int, controller, calibration=None):
+        """
+        A cross of the wall, showing the SCREEN_SIZE x SCREEN_SIZE part of the canvas starting at (y, x).
+        Args:
+            - `controller` is the endpoint of its controller, see `pharmacontroller.Controller`, or None to only preview it.
+            - `calibration` is a `Calibration`, or the path of a calibration file, for this cross only.
+              Only applied in 8 colors, as in `PharmaScreen`.
+        """
+        if not (0 <= y <= canvas.shape[0] - SCREEN_SIZE and 0 <= x <= canvas.shape[1] - SCREEN_SIZE):
+            raise ValueError(f"Cross at {(y, x)} does not fit in the {canvas.shape[0]}x{canvas.shape[1]} canvas")
+        self.y, self.x = y, x
+        # A view, so drawing into the canvas needs no copy
+        self.view = canvas[y : y + SCREEN_SIZE, x : x + SCREEN_SIZE]
+        self.controller = None if controller is None else Controller(controller)
+        if isinstance(calibration, str):
+            calibration = Calibration.load(calibration)
+        self.calibration = calibration
+
+    def leds(self, color_scale: bool) -> np.ndarray:
+        leds = CROSS.to_leds(self.view)
+        return leds if self.calibration is None or not color_scale else self.calibration.apply(leds)
+
+    def send(self, leds: np.ndarray, wire_format: str, color_scale: bool):
+        if self.controller is None:
+            return
+        self.controller.end_frame()
+        frame = self.view if self.calibration is None or not color_scale else CROSS.to_image(leds)
+        self.controller.send(encode_image(frame, wire_format, color_scale))
+
+
+class VideoWall:
+    def __init__(self, layout, color_scale: bool = True, wire_format: str = "json", preview: bool = True):
+        """
+        Several crosses showing one canvas, drawn into `canvas` then shown with `present`.
+        Args:
+            - `layout` is the path of a layout file, or its content as a dict (see the module docstring).
+            - `color_scale` enables up to 8 shades of green to be displayed, but reduces the expected framerate from 60 to 20FPS.
+            - `wire_format` is the encoding of the frames sent to the controllers, see `pharmacontroller.encode_frame`.
+            - `preview` shows the whole wall in a local window.
+        """
+        if wire_format not in WALL_WIRE_FORMATS:
+            raise ValueError(f"Unsupported wire format {wire_format!r}, expected one of {WALL_WIRE_FORMATS}")
+        if isinstance(layout, str):
+            layout = load_layout(layout)
+        crosses = layout["crosses"]
+        height = layout.get("height", max(cross["y"] for cross in crosses) + SCREEN_SIZE)
+        width = layout.get("width", max(cross["x"] for cross in crosses) + SCREEN_SIZE)
+
+        self.canvas = np.zeros((height, width))
+        self.crosses = [
+            WallCross(self.canvas, cross["y"], cross["x"], cross.get("controller"), cross.get("calibration"))
+            for cross in crosses
+        ]
+        self.color_scale = color_scale
+        self.wire_format = wire_format
+        self.fps = FPS_8COLOR if color_scale else FPS_2COLOR
+        self.clock = pygame.time.Clock()
+        self.executor = ThreadPoolExecutor(max_workers=len(self.crosses))
+
+        self.preview = None
+        if preview:
+            self.preview = pygame.display.set_mode([PREVIEW_PIXEL_SIZE * width, PREVIEW_PIXEL_SIZE * height])
+            # Canvas coordinates of the LEDs of every cross, in the order of `crosses`
+            self.preview_coords = [
+                (cross.y + r, cross.x + c) for cross in self.crosses for r, c in CROSS.led_coords
+            ]
+
+    @property
+    def height(self) -> int:
+        return self.canvas.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.canvas.shape[1]
+
+    def present(self):
+        """
+        Sends the canvas to the crosses, each one being encoded and sent in its own thread.
+        """
+        if not (0.0 <= self.canvas.min() and self.canvas.max() <= 1.0):
+            raise ValueError("Pixel values should be between 0.0 and 1.0")
+
+        leds = [cross.leds(self.color_scale) for cross in self.crosses]
+        sends = [
+            self.executor.submit(cross.send, cross_leds, self.wire_format, self.color_scale)
+            for cross, cross_leds in zip(self.crosses, leds)
+        ]
+        if self.preview is not None:
+            self.draw_preview(np.concatenate(leds))
+        for send in sends:
+            send.result()
+
+        self.frame_timing = self.clock.tick(self.fps)
+
+    def close(self):
+        """
+        Stops the threads sending the crosses.
+        """
+        self.executor.shutdown()
+
+    def __enter__(self) -> "VideoWall":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def draw_preview(self, leds: np.ndarray):
+        quantizer = 2 ** COLOR_DEPTH - 1 if self.color_scale else 1
+        values = (np.round(leds * quantizer) / quantizer).tolist()
+        self.preview.fill((0, 0, 0))
+        for (r, c), value in zip(self.preview_coords, values):
+            pygame.draw.circle(
+                self.preview,
+                (30, 30 + GREEN_BRIGHTNESS * value, 30),
+                (PREVIEW_PIXEL_SIZE * (c + 0.5), PREVIEW_PIXEL_SIZE * (r + 0.5)),
+                PREVIEW_PIXEL_SIZE * PIXEL_RADIUS_RATIO / 2,
+            )
+        pygame.display.flip()
+
+    def metrics(self) -> dict:
+        return {
+            "effective_fps": self.clock.get_fps(),
+            "controllers": [cross.controller.stats() for cross in self.crosses if cross.controller is not None],
+        }
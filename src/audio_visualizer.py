@@ -22,7 +22,7 @@ def get_amplitude_spectrum(data):
 
 # Function to draw techno sign as a wave based on amplitude spectrum
 def draw_techno_sign(screen, spectrum):
-    image = [[0.0 for _ in range(SCREEN_SIZE)] for _ in range(SCREEN_SIZE)]
+    image = screen.acquire()
     
     max_amplitude = np.max(spectrum)
     num_bins = len(spectrum)
@@ -32,20 +32,20 @@ def draw_techno_sign(screen, spectrum):
 
     spectrum /= max_amplitude
     
-    for point in range(num_points):
+    # Only the first SCREEN_SIZE points fit on the screen
+    wave_heights = np.zeros(SCREEN_SIZE, dtype=int)
+    for point in range(min(num_points, SCREEN_SIZE)):
         start_idx = point * point_width
         end_idx = min(start_idx + point_width, num_bins)
         mean_amplitude = np.mean(spectrum[start_idx:end_idx])
         
         wave_height = int(mean_amplitude * SCREEN_SIZE /2)  # Adjust amplitude to fit screen
+        wave_heights[point] = wave_height
 
-        for y_offset in range(-wave_height, wave_height):
-            y = SCREEN_SIZE // 2 + y_offset
-            x = point
-            if 0 <= y < SCREEN_SIZE and 0 <= x < SCREEN_SIZE:
-                image[y][x] = 1.0
+    y_offsets = np.arange(SCREEN_SIZE)[:, None] - SCREEN_SIZE // 2
+    image[(-wave_heights <= y_offsets) & (y_offsets < wave_heights)] = 1.0
 
-    screen.set_image(image)
+    screen.present()
 
 # Main function
 if __name__ == "__main__":
@@ -3,6 +3,7 @@ from math import sin
 import numpy as np
 import pygame
 
+import pharmadraw
 from pharmacontroller import PharmaScreen
 
 size = 48
@@ -76,30 +77,13 @@ def update_matrix(matrix, projected_vertices, edges):
 
 
 def bresenham(matrix, x0, y0, x1, y1):
-    dx = abs(x1 - x0)
-    dy = abs(y1 - y0)
-    sx = 1 if x0 < x1 else -1
-    sy = 1 if y0 < y1 else -1
-    err = dx - dy
-
-    while True:
-        if 0 <= x0 < size and 0 <= y0 < size:
-            matrix[y0, x0] = 1
-        if x0 == x1 and y0 == y1:
-            break
-        e2 = err * 2
-        if e2 > -dy:
-            err -= dy
-            x0 += sx
-        if e2 < dx:
-            err += dx
-            y0 += sy
+    pharmadraw.draw(matrix, pharmadraw.line(y0, x0, y1, x1, clip=False))
 
 
 if __name__ == "__main__":
     pygame.init()
     screen = PharmaScreen()
-    matrix = np.zeros((size, size), dtype=int)
+    matrix = np.zeros((size, size))
 
     k = 0
     while True:
@@ -108,4 +92,4 @@ if __name__ == "__main__":
         angles = np.array([angle_rad, angle_rad, angle_rad])
         projected_vertices = project(vertices, angles)
         update_matrix(matrix, projected_vertices, edges)
-        screen.set_image(matrix.tolist())
+        screen.set_image(matrix)
@@ -1,10 +1,13 @@
 # Chatgpt prompt: https://chatgpt.com/share/4b10b6ec-ed70-49e9-a69c-aa0db1167b1e
 
+import functools
 import sys
+import time
+import numpy as np
 import pygame
 import random
 
-from pharmacontroller import SCREEN_SIZE, PharmaScreen
+from pharmacontroller import SCREEN_SIZE, Compositor, PharmaScreen, Sprite
 
 
 ######################################################################
@@ -40,26 +43,34 @@ from pharmacontroller import SCREEN_SIZE, PharmaScreen
 #                                                                    #
 ######################################################################
 
-# Constants for the game
+# Constants for the game, speeds being per simulation step
 BIRD_SIZE = 2
 GRAVITY = 0.5
 FLAP_STRENGTH = -2.5
 OBSTACLE_WIDTH = 3
 GAP_HEIGHT = 16
 OBSTACLE_SPEED = 1
-FPS = 20
+SIM_RATE = 20  # Simulation steps per second, independent from the framerate of the screen
+SIM_STEP = 1 / SIM_RATE
+MAX_FRAME_TIME = .25  # Longest time simulated in a single frame, so that a stall does not fast-forward the game (in s)
 BIRD_X_OFFSET = 15  # Offset to center the bird on the left edge of the vertical cross
 
+def lerp(previous, current, alpha):
+    return previous + (current - previous) * alpha
+
 class Bird:
     def __init__(self):
         self.y = SCREEN_SIZE // 2
+        self.previous_y = self.y
         self.x = BIRD_X_OFFSET  # Use the bird offset constant
         self.velocity = 0
+        self.sprite = Sprite.from_mask(np.ones((BIRD_SIZE, BIRD_SIZE)), y=self.y, x=self.x)
 
     def flap(self):
         self.velocity = FLAP_STRENGTH
 
     def update(self):
+        self.previous_y = self.y
         self.velocity += GRAVITY
         self.y += self.velocity
 
@@ -71,14 +82,37 @@ class Bird:
             self.y = SCREEN_SIZE - BIRD_SIZE
             self.velocity = 0
 
+    def interpolate(self, alpha):
+        """Place the sprite between the last two simulation steps"""
+        self.sprite.y = lerp(self.previous_y, self.y, alpha)
+
+@functools.lru_cache(maxsize=None)
+def column_sprite_data(gap_start):
+    """Pixels and mask of a column, rendered once for each gap position and shared by the obstacles"""
+    mask = np.ones((SCREEN_SIZE, OBSTACLE_WIDTH), dtype=bool)
+    mask[gap_start:gap_start + GAP_HEIGHT] = False
+    pixels = np.ones(mask.shape)
+    mask.flags.writeable = False
+    pixels.flags.writeable = False
+    return pixels, mask
+
 class Obstacle:
     def __init__(self):
         self.x = SCREEN_SIZE
+        self.previous_x = self.x
         self.gap_start = random.randint(1, SCREEN_SIZE - GAP_HEIGHT - 1)
 
+        # The gap is left out of the mask
+        pixels, mask = column_sprite_data(self.gap_start)
+        self.sprite = Sprite(pixels, x=self.x, mask=mask)
+
     def update(self):
+        self.previous_x = self.x
         self.x -= OBSTACLE_SPEED
 
+    def interpolate(self, alpha):
+        self.sprite.x = lerp(self.previous_x, self.x, alpha)
+
     def is_off_screen(self):
         return self.x < -OBSTACLE_WIDTH
 
@@ -89,60 +123,72 @@ class Obstacle:
                 return True
         return False
 
-def draw_bird(screen, bird):
-    bird_y = int(bird.y)
-    bird_x = bird.x
-    for i in range(BIRD_SIZE):
-        for j in range(BIRD_SIZE):
-            if screen.is_drawable(bird_y + i, bird_x + j):
-                screen.pixel_buffer[bird_y + i][bird_x + j] = 1.0
-
-def draw_obstacles(screen, obstacles):
-    for obstacle in obstacles:
-        for y in range(SCREEN_SIZE):
-            if y < obstacle.gap_start or y >= obstacle.gap_start + GAP_HEIGHT:
-                for i in range(OBSTACLE_WIDTH):
-                    if screen.is_drawable(y, obstacle.x + i):
-                        screen.pixel_buffer[y][obstacle.x + i] = 1.0
+class Game:
+    def __init__(self):
+        self.compositor = Compositor()
+        self.bird = Bird()
+        self.obstacles = [Obstacle()]
+        self.compositor.add(self.obstacles[0].sprite)
+        self.compositor.add(self.bird.sprite)
+        self.running = True
+
+    def step(self):
+        """Advance the simulation by one SIM_STEP"""
+        bird = self.bird
+        bird.update()
+
+        if self.obstacles[-1].x < SCREEN_SIZE // 2:
+            self.obstacles.append(Obstacle())
+            # Obstacles are drawn below the bird
+            self.compositor.sprites.insert(0, self.obstacles[-1].sprite)
+
+        for obstacle in self.obstacles:
+            obstacle.update()
+            if obstacle.collides_with(bird):
+                self.running = False
+
+        for obstacle in self.obstacles:
+            if obstacle.is_off_screen():
+                self.compositor.remove(obstacle.sprite)
+        self.obstacles = [obs for obs in self.obstacles if not obs.is_off_screen()]
+
+    def render(self, alpha):
+        """Compose a frame `alpha` (0 to 1) of the way between the last two simulation steps"""
+        self.bird.interpolate(alpha)
+        for obstacle in self.obstacles:
+            obstacle.interpolate(alpha)
+        return self.compositor.compose()
 
 def main():
     pygame.init()
-    screen = PharmaScreen(True)
-    clock = pygame.time.Clock()
-    bird = Bird()
-    obstacles = [Obstacle()]
-    running = True
-
-    while running:
-        screen.pixel_buffer = [[0.0 for _ in range(SCREEN_SIZE)] for _ in range(SCREEN_SIZE)]
+    # Frames are only black and green, so the screen can switch to 60 FPS
+    screen = PharmaScreen("auto")
+    game = Game()
 
+    accumulator = 0.
+    previous_time = time.perf_counter()
+    while game.running:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
-                    bird.flap()
-
-        bird.update()
-
-        if obstacles[-1].x < SCREEN_SIZE // 2:
-            obstacles.append(Obstacle())
-
-        for obstacle in obstacles:
-            obstacle.update()
-            if obstacle.collides_with(bird):
-                print("Game Over")
-                pygame.quit()
-                sys.exit()
+                    game.bird.flap()
 
-        obstacles = [obs for obs in obstacles if not obs.is_off_screen()]
+        # Fixed timestep: the simulation runs at SIM_RATE whatever the framerate, set_image pacing the frames
+        now = time.perf_counter()
+        accumulator += min(now - previous_time, MAX_FRAME_TIME)
+        previous_time = now
+        while accumulator >= SIM_STEP and game.running:
+            game.step()
+            accumulator -= SIM_STEP
 
-        draw_bird(screen, bird)
-        draw_obstacles(screen, obstacles)
+        screen.set_image(game.render(accumulator / SIM_STEP))
 
-        screen.set_image(screen.pixel_buffer)
-        clock.tick(FPS)
+    print("Game Over")
+    pygame.quit()
+    sys.exit()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,61 @@
+import socket
+import time
+
+import numpy as np
+
+from pharmacontroller import (
+    CONTROLLER_PORT,
+    CROSS,
+    SCREEN_SIZE,
+    encode_image,
+    sequence_frame,
+)
+
+"""
+Load generator for receiver.py or a real controller
+Sends synthetic sequenced frames at a fixed rate, so that the receiver can measure loss, reordering and jitter.
+Raise TARGET_FPS (or set it to None to send as fast as possible) until the receiver reports losses
+to find the maximum sustainable framerate of a link.
+"""
+
+# Parameters
+HOST = "127.0.0.1"
+PORT = CONTROLLER_PORT
+TARGET_FPS = 240            # Frames sent per second, None for no limit
+DURATION = 10.              # Length of the test (in s)
+WIRE_FORMAT = "json"        # "json" or "binary", see pharmacontroller.encode_frame
+COLOR_SCALE = True          # 8 shades (3 bit planes) or 2 shades (1 bit plane) in the binary format
+N_PATTERNS = 64             # Distinct frames, encoded before the test so that only sending is measured
+
+def make_patterns(n=N_PATTERNS):
+    """Moving diagonal gradients, with every shade of green"""
+    rows, cols = np.mgrid[0:SCREEN_SIZE, 0:SCREEN_SIZE]
+    return [
+        encode_image((np.sin((rows + cols + 3 * i) / 6) + 1) / 2 * CROSS.mask, WIRE_FORMAT, COLOR_SCALE)
+        for i in range(n)
+    ]
+
+def run(host=HOST, port=PORT, fps=TARGET_FPS, duration=DURATION):
+    """Sends frames for `duration` seconds, returns the number of frames sent and the time taken"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    patterns = make_patterns()
+    period = 1 / fps if fps else 0.
+
+    start = time.perf_counter()
+    deadline = start
+    frame_id = 0
+    while deadline - start < duration:
+        now = time.perf_counter()
+        if now < deadline:
+            time.sleep(deadline - now)
+        sock.sendto(sequence_frame(patterns[frame_id % len(patterns)], frame_id, time.monotonic()), (host, port))
+        frame_id += 1
+        deadline = max(deadline + period, time.perf_counter() - period) if period else time.perf_counter()
+
+    return frame_id, time.perf_counter() - start
+
+if __name__ == "__main__":
+    sent, elapsed = run()
+    size = len(sequence_frame(make_patterns(1)[0], 0, 0.))
+    print(f"{sent} frames of {size} bytes in {elapsed:.2f}s: {sent / elapsed:.0f} FPS, "
+          f"{8 * size * sent / elapsed / 1e6:.1f} Mbit/s")
@@ -8,12 +8,13 @@ import numpy as np
 import pygame
 from pharmacontroller import SCREEN_SIZE, PharmaScreen
 size = 48
+DITHER = False  # Dithered 1 bit sub-frames at 60FPS, for controllers that decode the binary wire format
 t=0
 if __name__ == "__main__":
     pygame.init()
-    screen = PharmaScreen()
+    screen = PharmaScreen("dither", wire_format="binary") if DITHER else PharmaScreen()
     matrix = np.zeros((size, size), dtype=float)
-    screen.set_image(matrix.tolist())
+    screen.set_image(matrix)
 
     running = True
     while running:
@@ -30,4 +31,4 @@ if __name__ == "__main__":
                 p1 = np.cos(pt + i /3)
                 matrix[i][j] = ((p0 + p1)+2)/4
 
-        screen.set_image(matrix.tolist())
+        screen.set_image(matrix)
@@ -1,14 +1,16 @@
 # Use keys A/Q, P/M, U/I, X/C to control players
 
 import dataclasses
-import itertools
 import math
 import random
 import sys
-from typing import Tuple,List
+import time
+from typing import List
 
+import numpy as np
 import pygame
 
+import pharmadraw
 from pharmacontroller import PANEL_SIZE, SCREEN_SIZE, PharmaScreen
 
 PADDLE_SIZE = 6
@@ -19,6 +21,8 @@ BALL_RADIUS = 0.5
 DIAMOND_SIZE = 4
 WALL_OFFSET = 7
 ACCEL_FACTOR = 1.1
+PHYSICS_FPS = 20  # Rate of the physics clock, speeds are expressed in pixels per physics step
+MAX_SUBSTEP = 0.25  # Maximum distance (in pixels) travelled by the ball in a single sub-step
 
 PADDLE_POSITIONS = (
     (PANEL_SIZE, 0, True, 0, WALL_OFFSET),
@@ -37,13 +41,13 @@ class Paddle:
 
     def to_segment(self):
         return (
-            pygame.Vector2(
-                paddle.c - BALL_RADIUS * int(not paddle.is_vertical),
-                paddle.r - BALL_RADIUS * int(paddle.is_vertical),
+            (
+                self.c - BALL_RADIUS * int(not self.is_vertical),
+                self.r - BALL_RADIUS * int(self.is_vertical),
             ),
-            pygame.Vector2(
-                paddle.c + (BALL_RADIUS + paddle.size) * int(not paddle.is_vertical),
-                paddle.r + (BALL_RADIUS + paddle.size) * int(paddle.is_vertical),
+            (
+                self.c + (BALL_RADIUS + self.size) * int(not self.is_vertical),
+                self.r + (BALL_RADIUS + self.size) * int(self.is_vertical),
             ),
         )  # adding BALL_RADIUS to size when doing collision math to account for the ball's radius
 
@@ -75,44 +79,96 @@ class Ball:
             )
         return Ball(ballpos, ballv, BALL_RADIUS)
 
-    def collide_ball_segment(
-        self,
-        segment: Tuple[pygame.Vector2, pygame.Vector2],
-        perturb_if_collide=0.0,
-        accel_if_collide=1.0,
-        dt=1.0,
-    ):
-        sp1, sp2 = segment
-
-        pertx = random.random() - 0.5
-        perty = random.random() - 0.5
-
-        perturb = (
-            pygame.Vector2(pertx, perty).normalize()
-            * self.v.magnitude()
-            * perturb_if_collide
-        )
-
+    def collide_segments(self, segments, perturbs, accels, dt=1.0):
         """
-        for pt in (sp1, sp2):
-            if self.pos.distance_to(pt) < self.rad:
-                corner2ball = self.pos - pt
-                newv = corner2self.normalize() * self.v.magnitude()
-                return Ball(self.pos, newv * accel_if_collide + perturb, self.rad)
+        Bounces the ball on the first of the segments (array of shape (N, 2, 2)) crossed by its next move.
+        `perturbs` and `accels` hold the random perturbation and acceleration factor applied for each segment.
         """
-
-        if seg_intersect(sp1, sp2, self.pos, self.pos + self.v * dt):
+        for _ in range(len(segments)):
+            hits = np.flatnonzero(seg_intersect(
+                segments[:, 0], segments[:, 1], self.pos, self.pos + self.v * dt
+            ))
+            if len(hits) == 0:
+                return
+
+            i = hits[0]
+            sp1, sp2 = pygame.Vector2(*segments[i, 0]), pygame.Vector2(*segments[i, 1])
             seg_normal = (sp2 - sp1).rotate(90)
-            self.v = self.v.reflect(seg_normal) * accel_if_collide + perturb
+            perturb = pygame.Vector2(0, 0)
+            if perturbs[i]:
+                pertx = random.random() - 0.5
+                perty = random.random() - 0.5
+                perturb = (
+                    pygame.Vector2(pertx, perty).normalize()
+                    * self.v.magnitude()
+                    * perturbs[i]
+                )
+            self.v = self.v.reflect(seg_normal) * accels[i] + perturb
+
+    def step(self, segments, perturbs, accels):
+        """
+        Moves the ball by one physics step, split in sub-steps short enough to never cross a paddle.
+        """
+        substeps = max(1, math.ceil(self.v.magnitude() / MAX_SUBSTEP))
+        for _ in range(substeps):
+            self.collide_segments(segments, perturbs, accels, 1 / substeps)
+            self.pos += self.v / substeps
 
 
 def ccw(A, B, C):
-    return (C.y - A.y) * (B.x - A.x) > (B.y - A.y) * (C.x - A.x)
+    return (C[..., 1] - A[..., 1]) * (B[..., 0] - A[..., 0]) > (B[..., 1] - A[..., 1]) * (C[..., 0] - A[..., 0])
 
 
-# Return true if line segments AB and CD intersect
+# Return true if line segments AB and CD intersect, vectorized over the segments AB
 def seg_intersect(A, B, C, D):
-    return ccw(A, C, D) != ccw(B, C, D) and ccw(A, B, C) != ccw(A, B, D)
+    C, D = np.asarray(C), np.asarray(D)
+    return (ccw(A, C, D) != ccw(B, C, D)) & (ccw(A, B, C) != ccw(A, B, D))
+
+
+def draw_static_layer():
+    """The center diamond never moves, it is drawn once"""
+    return pharmadraw.diamond((SCREEN_SIZE - 1) / 2, (SCREEN_SIZE - 1) / 2, DIAMOND_SIZE)
+
+
+STATIC_LAYER = draw_static_layer()
+
+
+def move_paddles(paddles, pressed_keys):
+    # LEFT
+    if pressed_keys[pygame.K_a] and paddles[0].r > PANEL_SIZE:
+        paddles[0].r -= PADDLE_MOVE_SPEED
+    if (
+        pressed_keys[pygame.K_q]
+        and paddles[0].r + paddles[0].size < 2 * PANEL_SIZE - 1
+    ):
+        paddles[0].r += PADDLE_MOVE_SPEED
+
+    # RIGHT
+    if pressed_keys[pygame.K_p] and paddles[1].r > PANEL_SIZE:
+        paddles[1].r -= PADDLE_MOVE_SPEED
+    if (
+        pressed_keys[pygame.K_m]
+        and paddles[1].r + paddles[1].size < 2 * PANEL_SIZE - 1
+    ):
+        paddles[1].r += PADDLE_MOVE_SPEED
+
+    # TOP
+    if pressed_keys[pygame.K_u] and paddles[2].c > PANEL_SIZE:
+        paddles[2].c -= PADDLE_MOVE_SPEED
+    if (
+        pressed_keys[pygame.K_i]
+        and paddles[2].c + paddles[2].size < 2 * PANEL_SIZE - 1
+    ):
+        paddles[2].c += PADDLE_MOVE_SPEED
+
+    # BOTTOM
+    if pressed_keys[pygame.K_x] and paddles[3].c > PANEL_SIZE:
+        paddles[3].c -= PADDLE_MOVE_SPEED
+    if (
+        pressed_keys[pygame.K_c]
+        and paddles[3].c + paddles[3].size < 2 * PANEL_SIZE - 1
+    ):
+        paddles[3].c += PADDLE_MOVE_SPEED
 
 
 if __name__ == "__main__":
@@ -157,6 +213,17 @@ if __name__ == "__main__":
             new_wall.append(dst_pt)
         walls.append(tuple(new_wall))
 
+    wall_segments = np.array([[tuple(pt) for pt in wall] for wall in walls])
+    n_walls = len(wall_segments)
+    # Walls are plain bounces, paddles perturb and accelerate the ball
+    perturbs = np.array([0.0] * n_walls + [0.01] * len(paddles))
+    accels = np.array([1.0] * n_walls + [ACCEL_FACTOR] * len(paddles))
+    segments = np.concatenate((wall_segments, np.zeros((len(paddles), 2, 2))))
+
+    physics_dt = 1 / PHYSICS_FPS
+    last_time = time.perf_counter()
+    accumulator = 0.0
+
     running = True
     while running:
         for event in pygame.event.get():
@@ -166,86 +233,50 @@ if __name__ == "__main__":
 
         pressed_keys = pygame.key.get_pressed()
 
-        # LEFT
-        if pressed_keys[pygame.K_a] and paddles[0].r > PANEL_SIZE:
-            paddles[0].r -= PADDLE_MOVE_SPEED
-        if (
-            pressed_keys[pygame.K_q]
-            and paddles[0].r + paddles[0].size < 2 * PANEL_SIZE - 1
-        ):
-            paddles[0].r += PADDLE_MOVE_SPEED
-
-        # RIGHT
-        if pressed_keys[pygame.K_p] and paddles[1].r > PANEL_SIZE:
-            paddles[1].r -= PADDLE_MOVE_SPEED
-        if (
-            pressed_keys[pygame.K_m]
-            and paddles[1].r + paddles[1].size < 2 * PANEL_SIZE - 1
-        ):
-            paddles[1].r += PADDLE_MOVE_SPEED
-
-        # TOP
-        if pressed_keys[pygame.K_u] and paddles[2].c > PANEL_SIZE:
-            paddles[2].c -= PADDLE_MOVE_SPEED
-        if (
-            pressed_keys[pygame.K_i]
-            and paddles[2].c + paddles[2].size < 2 * PANEL_SIZE - 1
-        ):
-            paddles[2].c += PADDLE_MOVE_SPEED
-
-        # BOTTOM
-        if pressed_keys[pygame.K_x] and paddles[3].c > PANEL_SIZE:
-            paddles[3].c -= PADDLE_MOVE_SPEED
-        if (
-            pressed_keys[pygame.K_c]
-            and paddles[3].c + paddles[3].size < 2 * PANEL_SIZE - 1
-        ):
-            paddles[3].c += PADDLE_MOVE_SPEED
-
-        # Collisions
-        for wall in walls:
-            ball.collide_ball_segment(wall)
+        # The physics run at a fixed rate, whatever the rendering framerate
+        now = time.perf_counter()
+        accumulator = min(accumulator + now - last_time, 0.25)
+        last_time = now
 
-        for paddle in paddles:
-            ball.collide_ball_segment(
-                paddle.to_segment(),
-                perturb_if_collide=0.01,
-                accel_if_collide=ACCEL_FACTOR,
-            )
+        while accumulator >= physics_dt:
+            accumulator -= physics_dt
+            move_paddles(paddles, pressed_keys)
 
-        ball.pos += ball.v
+            for i, paddle in enumerate(paddles):
+                segments[n_walls + i] = paddle.to_segment()
+            ball.step(segments, perturbs, accels)
 
-        if (
-            ball.pos.x < 0
-            or ball.pos.y < 0
-            or ball.pos.x > 3 * PANEL_SIZE - 1
-            or ball.pos.y > 3 * PANEL_SIZE - 1
-        ):
-            ball = Ball.init_random_ball()
+            if (
+                ball.pos.x < 0
+                or ball.pos.y < 0
+                or ball.pos.x > 3 * PANEL_SIZE - 1
+                or ball.pos.y > 3 * PANEL_SIZE - 1
+            ):
+                ball = Ball.init_random_ball()
 
-        image = [[0.0 for c in range(SCREEN_SIZE)] for r in range(SCREEN_SIZE)]
+        image = screen.acquire()
 
         for paddle in paddles:
-            dr, dc = (1, 0) if paddle.is_vertical else (0, 1)
-            for i in range(paddle.size):
-                image[round(paddle.r) + dr * i][round(paddle.c) + dc * i] = 1.0
+            r, c = round(paddle.r), round(paddle.c)
+            if paddle.is_vertical:
+                image[r : r + paddle.size, c] = 1.0
+            else:
+                image[r, c : c + paddle.size] = 1.0
 
         base_x = int(ball.pos.x)
         base_y = int(ball.pos.y)
         for dx in (0, 1):
             for dy in (0, 1):
+                if base_y + dy >= SCREEN_SIZE or base_x + dx >= SCREEN_SIZE:
+                    continue
                 dst = math.dist((ball.pos.x, ball.pos.y), (base_x + dx, base_y + dy))
                 # dst = 0 : max
                 # dst = 1.4 : min
                 val = 1.5 - dst
                 image[base_y + dy][base_x + dx] = min(1.0, max(0.0, val))
 
-        for x, y in itertools.product(range(SCREEN_SIZE), repeat=2):
-            if (
-                abs(x - (SCREEN_SIZE - 1) / 2) + abs(y - (SCREEN_SIZE - 1) / 2)
-                < DIAMOND_SIZE + 0.01
-            ):
-                image[y][x] = 1.0
-        screen.set_image(image)
+        # The cached diamond is drawn over the ball
+        np.maximum(image, STATIC_LAYER, out=image)
+        screen.present()
 
     pygame.quit()
@@ -0,0 +1,282 @@
+import select
+import socket
+import struct
+import sys
+import time
+
+import numpy as np
+import pygame
+
+from pharmacontroller import (
+    CONTROLLER_PORT,
+    COLOR_DEPTH,
+    CROSS,
+    PANEL_MAGIC,
+    SCREEN_SIZE,
+    SYNC_MAGIC,
+    PharmaScreen,
+    PresentationQueue,
+    decode_frame,
+    decode_panel_packet,
+    is_newer_frame,
+    panel_ack,
+    sync_reply,
+)
+
+"""
+Reference receiver, standing in for the controller of the cross
+Listens on the controller port, decodes every frame format sent by PharmaScreen,
+answers clock synchronization requests and shows timed frames at their presentation time.
+
+Panel packets are applied to the current frame as soon as they arrive, and acknowledged,
+unless a newer frame of the same panel was already applied.
+Length-prefixed frames are also accepted over TCP on the same port (PharmaScreen(transport="tcp")).
+
+Per-frame statistics are printed every REPORT_INTERVAL seconds: arrival jitter, loss and
+reordering (for sequenced frames, see load_generator.py) and decode time.
+
+Point a module at it with PharmaScreen(server_ip="127.0.0.1"), or run load_generator.py.
+"""
+
+# Parameters
+HOST = "0.0.0.0"
+PORT = CONTROLLER_PORT
+PREVIEW = False         # Show the received frames in a window, otherwise they are only kept in a buffer
+REPORT_INTERVAL = 1.    # Time between two statistics reports (in s)
+MAX_PACKET_SIZE = 65535
+REORDER_WINDOW = 1024   # Number of recent frame ids remembered to detect duplicates
+MAX_BATCH = 256         # Packets handled before checking the timed frames
+
+class FrameStats:
+    def __init__(self):
+        """Arrival statistics of the frames received since the last reset"""
+        # Sequence state, kept across resets
+        self.highest_id = None
+        self.seen_ids = set()
+        self.last_arrival = None
+        self.last_transit = None
+        self.jitter = 0.
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.panels = 0
+        self.bytes = 0
+        self.errors = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.stale_panels = 0
+        self.decode_time = 0.
+        self.max_decode_time = 0.
+        self.intervals = []
+        if self.highest_id is not None:
+            # Frames more than REORDER_WINDOW ids late are counted as new ones
+            self.seen_ids = {i for i in self.seen_ids if i > self.highest_id - REORDER_WINDOW}
+
+    def record(self, frame, size, arrival, decode_time):
+        self.frames += 1
+        self.bytes += size
+        self.decode_time += decode_time
+        self.max_decode_time = max(self.max_decode_time, decode_time)
+
+        if self.last_arrival is not None:
+            self.intervals.append(arrival - self.last_arrival)
+        self.last_arrival = arrival
+
+        if frame.frame_id is None:
+            return
+
+        # Jitter estimator of RFC 3550, from the variation of the transit time between consecutive frames
+        transit = arrival - frame.sent_at
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16
+        self.last_transit = transit
+
+        if frame.frame_id in self.seen_ids:
+            self.duplicates += 1
+        elif self.highest_id is None or frame.frame_id > self.highest_id:
+            if self.highest_id is not None:
+                # Frames skipped over count as lost until they show up late
+                self.lost += frame.frame_id - self.highest_id - 1
+            self.highest_id = frame.frame_id
+        else:
+            self.reordered += 1
+            self.lost -= 1
+        self.seen_ids.add(frame.frame_id)
+
+    def report(self, duration):
+        intervals = np.array(self.intervals)
+        return {
+            "fps": self.frames / duration,
+            "panels": self.panels,
+            "mbps": 8 * self.bytes / duration / 1e6,
+            "lost": self.lost,
+            "reordered": self.reordered,
+            "duplicates": self.duplicates,
+            "stale_panels": self.stale_panels,
+            "errors": self.errors,
+            "jitter_ms": 1000 * (self.jitter if self.last_transit is not None else intervals.std() if len(intervals) else 0.),
+            "decode_us": 1e6 * self.decode_time / max(self.frames, 1),
+            "max_decode_us": 1e6 * self.max_decode_time,
+        }
+
+class Receiver:
+    def __init__(self, host=HOST, port=PORT, preview=PREVIEW):
+        """A controller listening for frames
+
+        Args:
+            - host (str, optional): address to listen on
+            - port (int, optional): UDP and TCP port to listen on
+            - preview (bool, optional): show the frames in a window. Defaults to PREVIEW.
+        """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.setblocking(False)
+        # Stream transport, on the same port number
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, self.socket.getsockname()[1]))
+        self.listener.listen()
+        self.listener.setblocking(False)
+        # Connected senders and the bytes received from them that do not make a whole frame yet
+        self.streams = {}
+        self.queue = PresentationQueue()
+        self.stats = FrameStats()
+        # Headless buffer holding the level of each LED of the frame shown last
+        self.leds = np.zeros(CROSS.n_leds, dtype=np.uint8)
+        # Frame id of the content shown by each panel, so that a late packet does not overwrite a newer one
+        self.panel_frames = {}
+        self.shown = 0
+        self.dirty = False
+        self.screen = PharmaScreen(server_ip=None) if preview else None
+
+    @property
+    def image(self):
+        return CROSS.to_image(self.leds / (2 ** COLOR_DEPTH - 1))
+
+    def handle(self, packet, address):
+        now = self.queue.clock()
+        if packet.startswith(SYNC_MAGIC):
+            try:
+                reply = sync_reply(packet, now, self.queue.clock(), self.queue.lateness)
+            except ValueError:
+                self.stats.errors += 1
+                return
+            self.socket.sendto(reply, address)
+            return
+
+        if packet.startswith(PANEL_MAGIC):
+            self.handle_panel(packet, address)
+            return
+
+        start = time.perf_counter()
+        try:
+            frame = decode_frame(packet)
+        except (ValueError, KeyError, TypeError):
+            self.stats.errors += 1
+            return
+        self.stats.record(frame, len(packet), now, time.perf_counter() - start)
+
+        if frame.present_at is None:
+            self.show(frame.leds)
+        else:
+            self.queue.push(frame.present_at, frame.leds)
+
+    def handle_panel(self, packet, address):
+        try:
+            frame_id, panel, panel_leds, levels = decode_panel_packet(packet)
+        except ValueError:
+            self.stats.errors += 1
+            return
+        if not is_newer_frame(frame_id, self.panel_frames.get(panel)):
+            # Not acknowledged either, the sender keeps the newer content as the one to confirm
+            self.stats.stale_panels += 1
+            return
+        self.panel_frames[panel] = frame_id
+        self.socket.sendto(panel_ack(frame_id, panel), address)
+        self.stats.panels += 1
+        self.stats.bytes += len(packet)
+
+        leds = self.leds.copy()
+        leds[panel_leds] = levels
+        self.show(leds)
+
+    def show(self, leds):
+        """Keeps the frame as the current one, the preview being redrawn once per poll"""
+        self.leds = leds
+        self.shown += 1
+        self.dirty = True
+
+    def draw(self):
+        if self.screen is not None:
+            self.screen.draw_leds((self.leds / (2 ** COLOR_DEPTH - 1)).tolist())
+            pygame.display.flip()
+        self.dirty = False
+
+    def read_stream(self, stream):
+        """Handles the whole frames received on a TCP connection"""
+        try:
+            data = stream.recv(MAX_PACKET_SIZE)
+        except ConnectionError:
+            data = b""
+        if not data:
+            del self.streams[stream]
+            stream.close()
+            return
+
+        buffer = self.streams[stream]
+        buffer += data
+        while len(buffer) >= 4:
+            (length,) = struct.unpack(">I", buffer[:4])
+            if len(buffer) < 4 + length:
+                break
+            self.handle(bytes(buffer[4 : 4 + length]), stream.getpeername())
+            del buffer[: 4 + length]
+
+    def poll(self, timeout=0.001):
+        """Handles the packets received within `timeout` seconds, then shows the timed frames that are due"""
+        readable, _, _ = select.select([self.socket, self.listener, *self.streams], [], [], timeout)
+        for sock in readable:
+            if sock is self.socket:
+                try:
+                    # Bounded, so that timed frames are still shown under a flood of packets
+                    for _ in range(MAX_BATCH):
+                        packet, address = self.socket.recvfrom(MAX_PACKET_SIZE)
+                        self.handle(packet, address)
+                except (BlockingIOError, ConnectionError):
+                    pass
+            elif sock is self.listener:
+                stream, _ = self.listener.accept()
+                stream.setblocking(False)
+                self.streams[stream] = bytearray()
+            else:
+                self.read_stream(sock)
+
+        leds = self.queue.pop_due()
+        if leds is not None:
+            self.show(leds)
+        if self.dirty:
+            self.draw()
+
+if __name__ == "__main__":
+    if PREVIEW:
+        pygame.init()
+    receiver = Receiver()
+    print(f"Listening on {HOST}:{PORT}, {SCREEN_SIZE}x{SCREEN_SIZE} frames")
+
+    last_report = time.perf_counter()
+    while True:
+        if PREVIEW:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    sys.exit()
+        receiver.poll()
+
+        now = time.perf_counter()
+        if now - last_report >= REPORT_INTERVAL:
+            report = receiver.stats.report(now - last_report)
+            print(" ".join(f"{key}={value:.1f}" if isinstance(value, float) else f"{key}={value}" for key, value in report.items()))
+            receiver.stats.reset()
+            last_report = now
@@ -25,7 +25,7 @@ if __name__ == "__main__":
     pygame.init()
     screen = PharmaScreen()
     matrix = np.zeros((size, size), dtype=float)
-    screen.set_image(matrix.tolist())
+    screen.set_image(matrix)
 
     running = True
     while running:
@@ -41,4 +41,4 @@ if __name__ == "__main__":
                 y = ( (j-24) * np.cos(t/10) + (i-24) * np.sin(t/10)) / ((np.sin(t/20)*3)+4)+4
                 matrix[i][j] = hzv[int(x)%8][int(y)%9]
 
-        screen.set_image(matrix.tolist())
+        screen.set_image(matrix)
@@ -1,130 +1,180 @@
 import math
+import numpy as np
 import pygame
 import random
 import sys
+import time
 
 PANEL_SIZE = 16
 SCREEN_SIZE = 3 * PANEL_SIZE
 SHAPE_SIZE = 10
 
-from pharmacontroller import PharmaScreen
+import pharmadraw
+from pharmacontroller import Compositor, PharmaScreen, Sprite
 
 def draw_square(image, size):
-    x = 3
-    y = 19
-    for i in range(size):
-        for j in range(size):
-            image[y + i][x + j] = 1.0
+    pharmadraw.draw(image, pharmadraw.rectangle(19, 3, size, size))
 
 def draw_circle(image, size):
-    x = 40
-    y = 23
-    radius = size // 2
-    for i in range(-radius, radius + 1):
-        for j in range(-radius, radius + 1):
-            if math.sqrt(i ** 2 + j ** 2) <= radius:
-                image[y + i][x + j] = 1.0
+    pharmadraw.draw(image, pharmadraw.disc(23, 40, size // 2))
 
 def draw_triangle(image, size):
-    x = 23
-    y = 3
-    for i in range(size):
-        half = math.ceil(i / 2)
-        for j in range(-half, half + 1):
-            image[y + i][x + j] = 1.0
+    half = math.ceil((size - 1) / 2)
+    pharmadraw.draw(image, pharmadraw.triangle((3, 23), (3 + size - 1, 23 - half), (3 + size - 1, 23 + half)))
 
 def draw_xlogo(image, size):
     x = 19
-    y = 35 
-    for i in range(size):
-        image[y + i][x + i] = 1.0
-        image[y + i][x + size - i - 1] = 1.0
+    y = 35
+    pharmadraw.draw(image, pharmadraw.line(y, x, y + size - 1, x + size - 1))
+    pharmadraw.draw(image, pharmadraw.line(y, x + size - 1, y + size - 1, x))
 
 def clear_screen():
-    return [[0.0 for _ in range(SCREEN_SIZE)] for _ in range(SCREEN_SIZE)]
+    return np.zeros((SCREEN_SIZE, SCREEN_SIZE))
+
+def make_shape_sprite(draw_function):
+    """Render a shape once, it is then only shown or hidden"""
+    image = clear_screen()
+    draw_function(image, SHAPE_SIZE)
+    return Sprite.from_mask(image > 0, visible=False)
+
+def show_shape(compositor, shape_sprites, shape=None):
+    """Compose a frame with only the given shape visible (none if `shape` is None)"""
+    for name, sprite in shape_sprites.items():
+        sprite.visible = name == shape
+    return compositor.compose()
+
+def render_frames():
+    """Pre-render the frame of each shape, and the blank frame (key None)"""
+    compositor = Compositor()
+    shape_sprites = {
+        shape: compositor.add(make_shape_sprite(function))
+        for shape, function in SHAPE_FUNCTIONS.items()
+    }
+    frames = {}
+    for shape in [*SHAPE_FUNCTIONS, None]:
+        frames[shape] = show_shape(compositor, shape_sprites, shape).copy()
+        frames[shape].flags.writeable = False
+    return frames
+
+def load_sounds():
+    return {
+        shape: pygame.mixer.Sound(f'simon_sounds/simonSound{i}.mp3')
+        for i, shape in enumerate(SHAPE_FUNCTIONS, start=1)
+    }
+
+SHAPE_FUNCTIONS = {
+    'square': draw_square,
+    'circle': draw_circle,
+    'triangle': draw_triangle,
+    'xlogo': draw_xlogo
+}
+SHAPE_DURATION = .5  # Time a shape stays on screen, when shown by the game or pressed by the player (in s)
+
+KEY_MAP = {
+    pygame.K_LEFT: 'square',
+    pygame.K_RIGHT: 'circle',
+    pygame.K_UP: 'triangle',
+    pygame.K_DOWN: 'xlogo'
+}
+
+# States of the game
+SHOWING, WAITING, PRESSED, GAME_OVER = range(4)
+
+class Simon:
+    def __init__(self, sounds=None, rng=random):
+        """Simon says, advanced by `update` at every frame instead of waiting between shapes
+
+        Args:
+            - sounds (dict, optional): sound of each shape, played when it is shown. Silent if None.
+            - rng (optional): random generator picking the shapes
+        """
+        self.sounds = sounds or {}
+        self.rng = rng
+        self.sequence = []
+        self.user_sequence = []
+        self.state = WAITING
+        self.shape = None  # Shape on screen
+        self.until = 0.    # End of the current shape (perf_counter time)
+        self.next_round(time.perf_counter())
+
+    def show(self, shape, now):
+        self.shape = shape
+        self.until = now + SHAPE_DURATION
+        if shape in self.sounds:
+            self.sounds[shape].play()
+
+    def next_round(self, now):
+        self.sequence.append(self.rng.choice([*SHAPE_FUNCTIONS]))
+        self.user_sequence = []
+        self.index = 0
+        self.state = SHOWING
+        self.show(self.sequence[0], now)
+
+    def handle_keydown(self, key, now=None):
+        if key not in KEY_MAP or self.state not in (WAITING, PRESSED):
+            return
+        if now is None:
+            now = time.perf_counter()
+        if self.state == PRESSED:
+            # Pressed before the end of the previous shape: it ends now
+            self.end_press(now)
+            if self.state != WAITING:
+                return
+
+        self.user_sequence.append(KEY_MAP[key])
+        self.state = PRESSED
+        self.show(KEY_MAP[key], now)
+
+    def end_press(self, now):
+        if self.user_sequence[-1] != self.sequence[len(self.user_sequence) - 1]:
+            self.state = GAME_OVER
+        elif len(self.user_sequence) == len(self.sequence):
+            self.next_round(now)
+        else:
+            self.state = WAITING
+            self.shape = None
+
+    def update(self, now=None):
+        """Advance the game to the current time, returns the shape to display (None for a blank screen)"""
+        if now is None:
+            now = time.perf_counter()
+
+        # Catch up with every shape that ended since the previous frame
+        while self.state in (SHOWING, PRESSED) and now >= self.until:
+            if self.state == PRESSED:
+                self.end_press(self.until)
+                continue
+            self.index += 1
+            if self.index < len(self.sequence):
+                # Shapes follow each other without a gap, from the end of the previous one
+                self.show(self.sequence[self.index], self.until)
+            else:
+                self.state = WAITING
+                self.shape = None
+
+        return self.shape
 
 def main():
     pygame.init()
     pygame.mixer.init()
     screen = PharmaScreen()
 
-    # Paramètres
-    shape_functions = {
-        'square': draw_square,
-        'circle': draw_circle,
-        'triangle': draw_triangle,
-        'xlogo': draw_xlogo
-    }
-    shapes = [*shape_functions.keys()]
-    sequence = []
-    user_sequence = []
-    current_index = 0
-    showing_sequence = True
-    add_shape = True
-
-    sounds = {
-        'square': pygame.mixer.Sound('simon_sounds/simonSound1.mp3'),
-        'circle': pygame.mixer.Sound('simon_sounds/simonSound2.mp3'),
-        'triangle': pygame.mixer.Sound('simon_sounds/simonSound3.mp3'),
-        'xlogo': pygame.mixer.Sound('simon_sounds/simonSound4.mp3')
-    }
+    frames = render_frames()
+    game = Simon(load_sounds())
 
-    key_map = {
-        pygame.K_LEFT: ('square', 'square'),
-        pygame.K_RIGHT: ('circle', 'circle'),
-        pygame.K_UP: ('triangle', 'triangle'),
-        pygame.K_DOWN: ('xlogo', 'xlogo')
-    }
-
-    running = True
-    while running:
+    while game.state != GAME_OVER:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
-            elif event.type == pygame.KEYDOWN and not showing_sequence:
-                if event.key in key_map:
-                    shape, sound_key = key_map[event.key]
-                    user_sequence.append(shape)
-                    sounds[sound_key].play()
-                    image = clear_screen()
-                    shape_functions[shape](image, SHAPE_SIZE)
-                    screen.set_image(image)
-                pygame.time.delay(500)
-
-
-                if len(user_sequence) <= len(sequence):
-                    if user_sequence[-1] != sequence[len(user_sequence) - 1]:
-                        print("Game Over! The correct sequence was:", sequence)
-                        pygame.quit()
-                        sys.exit()
-
-                if len(user_sequence) == len(sequence):
-                    if user_sequence == sequence:
-                        add_shape = True
-                    user_sequence = []
-                    current_index = 0
-                    showing_sequence = True
-
-        if showing_sequence:
-            if add_shape:
-                sequence.append(random.choice(shapes))
-                add_shape = False
-
-            image = clear_screen()
-            shape = sequence[current_index]
-            shape_functions[shape](image, SHAPE_SIZE)
-            sounds[shape].play()
-            screen.set_image(image)
-            pygame.time.delay(500)
-            current_index += 1
-
-            if current_index == len(sequence):
-                showing_sequence = False
-        else:
-            image = clear_screen()
-            screen.set_image(image)
-            pygame.time.delay(500)
+            elif event.type == pygame.KEYDOWN:
+                game.handle_keydown(event.key)
+
+        screen.set_image(frames[game.update()])
+
+    print("Game Over! The correct sequence was:", game.sequence)
+    pygame.quit()
+    sys.exit()
 
 if __name__ == '__main__':
     main()
@@ -1,10 +1,12 @@
 import time
 import random
+from collections import deque
 from enum import Enum
 
+import numpy as np
 import pygame
 
-from pharmacontroller import SCREEN_SIZE, PharmaScreen
+from pharmacontroller import CROSS, SCREEN_SIZE, PharmaScreen
 from textwriter import String
 
 class Direction(Enum):
@@ -29,9 +31,15 @@ class Snake:
         self.time = time.time()
 
         self.starting_cell = (16, 0)
-        self.tail = [None] * self.length
-        for i in range(self.length):
-            self.tail[i] = (16, self.length - 1 - i)
+        # Head first, with an occupancy bitmap indexed by [y, x] to check collisions in O(1)
+        self.tail = deque((16, self.length - 1 - i) for i in range(self.length))
+        self.occupied = np.zeros((SCREEN_SIZE, SCREEN_SIZE), dtype=bool)
+
+        # Index of the free drawable cells: list of cells, and position of each cell in that list
+        self.free_cells = [(int(x), int(y)) for y, x in zip(*np.nonzero(CROSS.mask))]
+        self.free_index = {cell: i for i, cell in enumerate(self.free_cells)}
+        for cell in self.tail:
+            self.occupy(cell)
 
         self.apple = (23, 23)
         self.has_won = False
@@ -55,16 +63,17 @@ class Snake:
             new_head = (self.tail[0][0] + to_add[0], self.tail[0][1] + to_add[1])
 
             # Wall collision
-            if not PharmaScreen.is_drawable(None, new_head[0], new_head[1]) or new_head in self.tail[1:]:
+            if not CROSS.is_drawable(new_head[1], new_head[0]) or self.occupied[new_head[1], new_head[0]]:
                 self.has_lost = True
                 return False
 
-            self.tail.insert(0, new_head)
+            self.tail.appendleft(new_head)
+            self.occupy(new_head)
             if len(self.tail) == self.MAX_LENGTH:
                 self.has_won = True
             apple_eaten = self.update_apple()
             if not apple_eaten:
-                del self.tail[-1]
+                self.release(self.tail.pop())
 
             self.heading_changed_in_frame = False
             self.time = time.time()
@@ -73,49 +82,57 @@ class Snake:
         if self.heading_changed_in_frame: return
 
         if pressed_keys[pygame.K_UP]:
-            if snake.heading != Direction.SOUTH:
+            if self.heading != Direction.SOUTH:
                 self.heading_changed_in_frame = True
-                snake.heading = Direction.NORTH
+                self.heading = Direction.NORTH
         if pressed_keys[pygame.K_DOWN]:
-            if snake.heading != Direction.NORTH:
+            if self.heading != Direction.NORTH:
                 self.heading_changed_in_frame = True
-                snake.heading = Direction.SOUTH
+                self.heading = Direction.SOUTH
         if pressed_keys[pygame.K_LEFT]:
-            if snake.heading != Direction.EAST:
+            if self.heading != Direction.EAST:
                 self.heading_changed_in_frame = True
-                snake.heading = Direction.WEST
+                self.heading = Direction.WEST
         if pressed_keys[pygame.K_RIGHT]:
-            if snake.heading != Direction.WEST:
+            if self.heading != Direction.WEST:
                 self.heading_changed_in_frame = True
-                snake.heading = Direction.EAST
+                self.heading = Direction.EAST
+
+    def occupy(self, cell):
+        """Mark a cell as part of the snake, removing it from the free cells in O(1)"""
+        self.occupied[cell[1], cell[0]] = True
+        i = self.free_index.pop(cell)
+        last = self.free_cells.pop()
+        if last != cell:
+            self.free_cells[i] = last
+            self.free_index[last] = i
+
+    def release(self, cell):
+        """Give back a cell left by the end of the snake"""
+        self.occupied[cell[1], cell[0]] = False
+        self.free_index[cell] = len(self.free_cells)
+        self.free_cells.append(cell)
 
     def update_apple(self):
         if self.tail[0] == self.apple:
-            avaiable_cells = []
-            for x in range(48):
-                for y in range(48):
-                    if PharmaScreen.is_drawable(None, x, y) and (x, y) not in self.tail : 
-                        avaiable_cells.append((x, y))
-            self.apple = random.choice(avaiable_cells)
+            if self.free_cells:
+                self.apple = random.choice(self.free_cells)
             return True
         return False
     
     def draw(self):
         if self.has_lost or self.has_won: return
-        for cell in self.tail:
-            self.image[cell[1]][cell[0]] = self.SNAKE_BRIGHTNESS
+        self.image[self.occupied] = self.SNAKE_BRIGHTNESS
         self.image[self.apple[1]][self.apple[0]] = self.APPLE_BRIGHTNESS
 
 def clear(image):
-    for line in image:
-        for i in range(len(line)):
-            line[i] = 0 
+    image.fill(0)
 
 if __name__ == "__main__":
     pygame.init()
     screen = PharmaScreen()
 
-    image = [[0.0 for c in range(SCREEN_SIZE)] for r in range(SCREEN_SIZE)]
+    image = np.zeros((SCREEN_SIZE, SCREEN_SIZE))
 
     loosing_string = String(image, (1, 18), 45, "Perdu")
     winning_string = String(image, (1, 18), 45, "GG WP", cooldown=0.03, timeout=0)
@@ -134,9 +151,7 @@ if __name__ == "__main__":
             loosing_string.scroll()
         elif snake.has_won:
             # Color for the middle line of the cross 
-            for line in image[16:32]:
-                for i in range(len(line)):
-                    line[i] = (1)
+            image[16:32] = 1
             winning_string.scroll(inverted=True)
         else:
             snake.update(pygame.key.get_pressed())
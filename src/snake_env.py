@@ -0,0 +1,164 @@
+import time
+
+import numpy as np
+
+from pharmacontroller import CROSS, SCREEN_SIZE
+
+"""
+Headless snake environment, running many games at once on numpy arrays.
+Used to tune and run unattended bots, the interactive game lives in snake.py
+
+Each board stores the remaining lifetime of every body cell (the head holds the snake length,
+the end of the tail holds 1), so moving every snake is a single subtraction.
+
+Run this file to measure the throughput of a greedy bot in game-steps per second.
+"""
+
+# Cells with an LED, indexed by [y, x], shared by all the games
+DRAWABLE = CROSS.mask
+MAX_LENGTH = CROSS.n_leds
+
+# (dy, dx) for each heading, in the order of snake.Direction
+NORTH, SOUTH, EAST, WEST = range(4)
+MOVES = np.array([(-1, 0), (1, 0), (0, 1), (0, -1)])
+OPPOSITE = np.array([SOUTH, NORTH, WEST, EAST])
+
+APPLE_REWARD = 1.
+LOSS_REWARD = -1.
+
+class SnakeEnv:
+    def __init__(self, n_games, length=10, seed=None, auto_reset=True):
+        """N games of snake advanced together with `step`
+
+        Args:
+            - n_games (int): number of games played in parallel
+            - length (int, optional): start length of the snakes. Defaults to 10.
+            - seed (optional): seed of the random generator placing the apples
+            - auto_reset (bool, optional): restart finished games at the end of `step`. Defaults to True.
+        """
+        assert 2 <= length <= 10, "start length must be between 2 and 10"
+        self.n_games = n_games
+        self.start_length = length
+        self.auto_reset = auto_reset
+        self.rng = np.random.default_rng(seed)
+
+        self.boards = np.zeros((n_games, SCREEN_SIZE, SCREEN_SIZE), dtype=np.int16)
+        self.heads = np.zeros((n_games, 2), dtype=np.int64)
+        self.headings = np.zeros(n_games, dtype=np.int64)
+        self.lengths = np.zeros(n_games, dtype=np.int64)
+        self.apples = np.zeros((n_games, 2), dtype=np.int64)
+        self.done = np.zeros(n_games, dtype=bool)
+        self.won = np.zeros(n_games, dtype=bool)
+        self.steps = 0
+        self.reset()
+
+    def reset(self, games=None):
+        """Restart the given games (all of them by default), like a new snake.Snake"""
+        games = np.arange(self.n_games) if games is None else np.asarray(games)
+        length = self.start_length
+
+        self.boards[games] = 0
+        # Starts in column 16 going south, the head at the bottom
+        self.boards[games, :length, 16] = np.arange(1, length + 1)
+        self.heads[games] = (length - 1, 16)
+        self.headings[games] = SOUTH
+        self.lengths[games] = length
+        self.apples[games] = (23, 23)
+        self.done[games] = False
+        self.won[games] = False
+
+    def observe(self):
+        """Board, head, heading and apple of every game"""
+        return self.boards, self.heads, self.headings, self.apples
+
+    def step(self, actions):
+        """Move every running game one cell in the direction of `actions` (headings, reversals are ignored)
+
+        Returns the rewards and the games that ended during this step.
+        """
+        actions = np.asarray(actions)
+        playing = ~self.done
+        headings = np.where(actions == OPPOSITE[self.headings], self.headings, actions)
+        self.headings[playing] = headings[playing]
+
+        new_heads = self.heads + MOVES[self.headings]
+        y, x = new_heads[:, 0], new_heads[:, 1]
+        inside = (0 <= y) & (y < SCREEN_SIZE) & (0 <= x) & (x < SCREEN_SIZE)
+        cy, cx = np.clip(y, 0, SCREEN_SIZE - 1), np.clip(x, 0, SCREEN_SIZE - 1)
+        games = np.arange(self.n_games)
+
+        # Walls and every body cell, including the end of the tail, are deadly
+        lost = playing & ~(inside & DRAWABLE[cy, cx] & (self.boards[games, cy, cx] == 0))
+        moving = playing & ~lost
+        eaten = moving & (new_heads == self.apples).all(axis=1)
+
+        # The snakes shrink from the tail, unless they just ate
+        shrinking = moving & ~eaten
+        boards = self.boards[shrinking]
+        boards -= boards > 0
+        self.boards[shrinking] = boards
+        self.lengths[eaten] += 1
+        self.heads[moving] = new_heads[moving]
+        self.boards[games[moving], cy[moving], cx[moving]] = self.lengths[moving]
+
+        won = eaten & (self.lengths == MAX_LENGTH)
+        self.place_apples(np.flatnonzero(eaten & ~won))
+
+        rewards = np.where(eaten, APPLE_REWARD, 0.) + np.where(lost, LOSS_REWARD, 0.)
+        ended = lost | won
+        self.won |= won
+        self.done |= ended
+        self.steps += int(playing.sum())
+
+        if self.auto_reset and ended.any():
+            self.reset(np.flatnonzero(ended))
+
+        return rewards, ended
+
+    def place_apples(self, games):
+        """Pick a random free cell for each game, all at once"""
+        if len(games) == 0:
+            return
+        free = DRAWABLE & (self.boards[games] == 0)
+        scores = self.rng.random(free.shape) * free
+        cells = scores.reshape(len(games), -1).argmax(axis=1)
+        self.apples[games] = np.stack(np.unravel_index(cells, (SCREEN_SIZE, SCREEN_SIZE)), axis=1)
+
+    def render(self, game=0, image=None, snake_brightness=1., apple_brightness=.6):
+        """Draw a single game into a 48x48 frame, ready for PharmaScreen.set_image"""
+        if image is None:
+            image = np.zeros((SCREEN_SIZE, SCREEN_SIZE))
+        image.fill(0)
+        image[self.boards[game] > 0] = snake_brightness
+        image[tuple(self.apples[game])] = apple_brightness
+        return image
+
+def greedy_policy(env):
+    """Heads towards the apple, avoiding the cells that would end the game right away"""
+    boards, heads, headings, apples = env.observe()
+    games = np.arange(env.n_games)
+
+    candidates = heads[:, None, :] + MOVES[None, :, :]
+    y, x = candidates[..., 0], candidates[..., 1]
+    inside = (0 <= y) & (y < SCREEN_SIZE) & (0 <= x) & (x < SCREEN_SIZE)
+    cy, cx = np.clip(y, 0, SCREEN_SIZE - 1), np.clip(x, 0, SCREEN_SIZE - 1)
+    safe = inside & DRAWABLE[cy, cx] & (boards[games[:, None], cy, cx] == 0)
+    safe &= np.arange(4)[None, :] != OPPOSITE[headings][:, None]
+
+    distance = np.abs(candidates - apples[:, None, :]).sum(axis=2)
+    return np.where(safe, distance, np.iinfo(np.int64).max).argmin(axis=1)
+
+if __name__ == "__main__":
+    N_GAMES = 1024
+    N_STEPS = 1000
+
+    env = SnakeEnv(N_GAMES, seed=0)
+    apples = 0
+    start = time.perf_counter()
+    for _ in range(N_STEPS):
+        rewards, _ = env.step(greedy_policy(env))
+        apples += int((rewards > 0).sum())
+    duration = time.perf_counter() - start
+
+    print(f"{env.steps} game-steps in {duration:.2f}s: {env.steps / duration:.0f} game-steps/s, "
+          f"{apples / N_GAMES:.1f} apples per game")
@@ -0,0 +1,239 @@
+import random
+import time
+
+"""
+Headless TETRIS rules, used by tetris.py
+
+The board is a bitboard: one int per row, bit x being set when column x is filled.
+Every piece rotation is precomputed as row masks already shifted for each column,
+so collision checks and line clears only touch the (at most 4) rows of a piece.
+
+Run this file to measure how many random games can be simulated per second.
+"""
+
+# Parameters
+START_SPEED = .5            # Time between two down movements of the falling piece at the start (in s)
+SPEEDUP_FACTOR = .94        # Factor by which the previously mentionned time is multiplied when completing a line
+POINTS = [1, 4, 9, 16]      # Points earned by completing 1, 2, 3 and 4 lines at once respectively
+
+# Default board size, matching the central column of the cross with pieces of 2x2 pixels
+HEIGHT = 24
+WIDTH = 8
+
+PIECES = [
+    [[0, 0, 0, 0], [1, 1, 1, 1], [0, 0, 0, 0], [0, 0, 0, 0]], # I
+    [[1, 1], [1, 1]], # O
+    [[0, 1, 1], [1, 1, 0], [0, 0, 0]], # S
+    [[1, 1, 0], [0, 1, 1], [0, 0, 0]], # Z
+    [[0, 1, 0], [0, 1, 0], [0, 1, 1]], # L
+    [[0, 1, 0], [0, 1, 0], [1, 1, 0]], # J
+    [[0, 0, 0], [1, 1, 1], [0, 1, 0]], # T
+]
+
+def rotate_piece(piece):
+    piece = [line for line in piece[::-1]]
+    piece = [[piece[x][y] for x in range(len(piece))] for y in range(len(piece))]
+
+    return piece
+
+class Rotation:
+    def __init__(self, matrix, width):
+        """A single orientation of a piece, with its row masks precomputed for every column"""
+        self.matrix = tuple(map(tuple, matrix))
+        self.size = len(matrix)
+        self.rows = [dy for dy in range(self.size) if any(matrix[dy])]
+        cols = [dx for dx in range(self.size) if any(line[dx] for line in matrix)]
+        # Range of valid positions on the board
+        self.min_x, self.max_x = -cols[0], width - 1 - cols[-1]
+        self.top, self.bottom = self.rows[0], self.rows[-1]
+
+        # shifted[x - min_x] lists (dy, row mask) for the piece placed at column x
+        self.shifted = []
+        for x in range(self.min_x, self.max_x + 1):
+            masks = []
+            for dy in self.rows:
+                mask = 0
+                for dx in range(self.size):
+                    if matrix[dy][dx]:
+                        mask |= 1 << (x + dx)
+                masks.append((dy, mask))
+            self.shifted.append(masks)
+
+def build_rotations(width=WIDTH):
+    """Rotation tables: ROTATIONS[kind][r] is the piece `kind` rotated r times clockwise"""
+    rotations = []
+    for piece in PIECES:
+        piece_rotations = []
+        for _ in range(4):
+            piece_rotations.append(Rotation(piece, width))
+            piece = rotate_piece(piece)
+        rotations.append(piece_rotations)
+
+    return rotations
+
+class TetrisEngine:
+    def __init__(self, seed=None, height=HEIGHT, width=WIDTH):
+        """Game rules of tetris, advanced explicitly with `tick` and the move methods
+
+        Args:
+            - seed (optional): seed of the piece generator, for reproducible games
+            - height (int, optional): number of rows of the board
+            - width (int, optional): number of columns of the board
+        """
+        self.height = height
+        self.width = width
+        self.full_row = (1 << width) - 1
+        self.rotations = ROTATIONS if width == WIDTH else build_rotations(width)
+        self.rng = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.board = [0] * self.height
+        self.speed = START_SPEED
+        self.score = 0
+        self.lines = 0
+        self.pieces = 0
+        self.running = True
+        self.elapsed = 0.
+        # Incremented each time the settled pieces change
+        self.board_version = 0
+
+        self.next_kind, self.next_rotation = self.random_piece()
+        self.new_piece()
+
+    def random_piece(self):
+        return self.rng.randrange(len(self.rotations)), self.rng.randrange(4)
+
+    @property
+    def piece(self):
+        return self.rotations[self.kind][self.rotation]
+
+    @property
+    def next_piece(self):
+        return self.rotations[self.next_kind][self.next_rotation]
+
+    def new_piece(self):
+        spawn_x = (self.width - 1) // 2
+        # If we can't place the new piece, game over
+        if not self.check_piece(0, spawn_x, self.next_piece):
+            self.running = False
+            return
+
+        self.kind, self.rotation = self.next_kind, self.next_rotation
+        self.next_kind, self.next_rotation = self.random_piece()
+        self.piece_y = 0
+        self.piece_x = spawn_x
+        self.pieces += 1
+
+    def check_piece(self, piece_y, piece_x, piece):
+        if not (piece.min_x <= piece_x <= piece.max_x):
+            return False
+        if piece_y + piece.top < 0 or piece_y + piece.bottom >= self.height:
+            return False
+
+        board = self.board
+        for dy, mask in piece.shifted[piece_x - piece.min_x]:
+            if board[piece_y + dy] & mask:
+                return False
+
+        return True
+
+    def tick(self, dt):
+        """Advance the game clock by `dt` seconds, the piece falls each `speed` seconds"""
+        if not self.running:
+            return
+        self.elapsed += dt
+        while self.running and self.elapsed >= self.speed:
+            self.elapsed -= self.speed
+            self.drop()
+
+    def drop(self):
+        """Move the piece down one row, or deposit it. Returns whether the piece moved"""
+        if not self.running:
+            return False
+        if self.check_piece(self.piece_y + 1, self.piece_x, self.piece):
+            self.piece_y += 1
+            return True
+
+        self.deposit_piece()
+        self.new_piece()
+        return False
+
+    def hard_drop(self):
+        self.piece_y = self.end_pos()[0]
+        self.drop()
+
+    def move(self, dx):
+        """Move the piece sideways. Returns whether the piece moved"""
+        if self.running and self.check_piece(self.piece_y, self.piece_x + dx, self.piece):
+            self.piece_x += dx
+            return True
+        return False
+
+    def rotate(self):
+        """Rotate the piece 90° clockwise, moving it one column aside if needed"""
+        if not self.running:
+            return False
+        rotation = (self.rotation + 1) % 4
+        new_piece = self.rotations[self.kind][rotation]
+        for dx in (0, 1, -1):
+            if self.check_piece(self.piece_y, self.piece_x + dx, new_piece):
+                self.rotation = rotation
+                self.piece_x += dx
+                return True
+        return False
+
+    def deposit_piece(self):
+        piece = self.piece
+        board = self.board
+        for dy, mask in piece.shifted[self.piece_x - piece.min_x]:
+            board[self.piece_y + dy] |= mask
+
+        # Only the rows of the piece can have been completed
+        completed = [self.piece_y + dy for dy in piece.rows if board[self.piece_y + dy] == self.full_row]
+        if completed:
+            for y in completed:
+                del board[y]
+                board.insert(0, 0)
+
+            self.lines += len(completed)
+            self.score += POINTS[len(completed) - 1]
+            self.speed *= SPEEDUP_FACTOR ** len(completed)
+
+        self.board_version += 1
+
+    def end_pos(self):
+        y = self.piece_y
+        while self.check_piece(y + 1, self.piece_x, self.piece):
+            y += 1
+
+        return (y, self.piece_x)
+
+    def cell(self, y, x):
+        return (self.board[y] >> x) & 1
+
+def random_bot(engine):
+    """Plays a random move then drops the piece, used for demos and benchmarks"""
+    for _ in range(engine.rng.randrange(4)):
+        engine.rotate()
+    dx = engine.rng.choice((-1, 1))
+    for _ in range(engine.rng.randrange(engine.width // 2 + 1)):
+        engine.move(dx)
+    engine.hard_drop()
+
+ROTATIONS = build_rotations()
+
+if __name__ == "__main__":
+    N_GAMES = 2000
+
+    start = time.perf_counter()
+    pieces = 0
+    for seed in range(N_GAMES):
+        engine = TetrisEngine(seed)
+        while engine.running:
+            random_bot(engine)
+        pieces += engine.pieces
+    duration = time.perf_counter() - start
+
+    print(f"{N_GAMES} games, {pieces} pieces in {duration:.2f}s: "
+          f"{N_GAMES / duration:.0f} games/s, {pieces / duration:.0f} pieces/s")
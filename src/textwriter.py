@@ -2,89 +2,105 @@ import pygame
 
 import sys
 import time
-import json
+import math
 
-from pharmacontroller import PharmaScreen, SCREEN_SIZE
+import numpy as np
 
-# loads the letters
-with open("./letters.json", "r") as f:
-    LETTERS = json.load(f)
-    f.close()
+from pharmacontroller import PharmaScreen, SCREEN_SIZE, blit
+from pharmafont import get_font
+
+MAX_SCROLL_DT = 0.15  # Longest time a single scroll can account for, so that a stall does not make the text jump (in s)
 
 class Letter:
-    def __init__(self, symbol:str, coords:tuple):
+    def __init__(self, symbol:str, coords:tuple, font:str = "large"):
         """A class to represent a letter on the cross
 
         Args:
             - symbol (str): the char represented
             - coords (tuple): coordinates of the letter in the cross
+            - font (str, optional): name of the font in pharmafont. Defaults to "large".
         """
         assert len(symbol) == 1, f"A letter needs to be 1 character long, {symbol} is empty or more than 1 char"
         self.symbol = symbol.strip().upper()
         self.coords = coords
         # Representation of the letter in matrix form
-        self.matrix = LETTERS[symbol]
+        self.matrix = get_font(font).glyph(symbol)
         # Dimensions in dots
-        self.width = len(self.matrix[0])
-        self.height = len(self.matrix)
+        self.height, self.width = self.matrix.shape
 
     def draw(self, image, inverted:bool = False, xbounds:tuple = (0,False)):
         """Draw the letter at its coordinates
 
         Args:
-            - image (list): the matrix representing the screen to draw on
+            - image (np.ndarray): the matrix representing the screen to draw on
             - inverted (bool, optional): Determine if the letter is green or disabled. Defaults to False.
             - xbounds (tuple, optional): Limits of the letter, the first element of the tuple is the minimal coord where the letter can be drawn. The second is the limit on the right side. Defaults to (0,False).
         """
         # determine if the letter is cutted on the left
         left_cut = xbounds[0] - self.coords[0]
         if left_cut < 0: left_cut = 0
+        right_cut = self.width
+        if xbounds[1]:
+            right_cut = min(right_cut, xbounds[1] - self.coords[0] + 1)
+        if right_cut <= left_cut:
+            return
 
-        for y, line in enumerate(image[self.coords[1]:self.coords[1] + self.height]):
-            for x in range(left_cut, self.width):
-                overflow = xbounds[1] and self.coords[0] + x > xbounds[1]
-                if overflow:
-                    break
-                color = 1 ^ self.matrix[y][x] if inverted else self.matrix[y][x]
-                line[self.coords[0] + x] = color
+        values = 1 ^ self.matrix if inverted else self.matrix
+        window = values[:, left_cut:right_cut]
+        blit(image, window, np.ones(window.shape, dtype=bool), self.coords[1], self.coords[0] + left_cut)
 
     def __str__(self) -> str:
         return self.symbol
 
 class String:
-    def __init__(self, image, coords:tuple, width:int, text:str, cooldown:float = 0.05, timeout:float = 0.3):
+    def __init__(self, image, coords:tuple, width:int, text:str, cooldown:float = 0.05, timeout:float = 0.3, font:str = "large"):
         """A class to represent a string on the cross
 
+        The text is rasterized once into a strip, scrolling only moves a window over it.
+
         Args:
-            - image (list): the matrix representing the screen to draw on
+            - image (np.ndarray): the matrix representing the screen to draw on
             - coords (tuple): the coordinates of the string on the cross
             - width (int): width of the string (the limit where the string will not be displayed)
             - text (str): the text to display
-            - cooldown (float, optional): cooldown betwen letters scroll. Defaults to 0.05.
+            - cooldown (float, optional): time needed to scroll by one column. Defaults to 0.05.
             - timeout (float, optional): time before the text return on the screen. Defaults to 0.3.
+            - font (str, optional): name of the font in pharmafont. Defaults to "large".
         """
         self.image = image
+        self.font = get_font(font)
         self.coords = coords
         self.width = width
         # x coord of the string right limit
         self.xlimit = self.coords[0] + self.width
 
         self.cooldown = cooldown
-        self.time = time.time()
+        # Scroll speed in columns per second, positions are kept as floats
+        self.speed = 1 / cooldown
+        # Set by the first scroll, the string may be created long before it is shown
+        self.time = None
         self.timeout = timeout
         self.timeout_state = False
+        self.timeout_left = 0.0
 
         # Coords are specified when drawing
         self.letters = list(
-            map(lambda x: Letter(x, (0, 0)), text.upper().strip())
+            map(lambda x: Letter(x, (0, 0), font), text.upper().strip())
         )
-        # Actual width of the string
-        self.dot_width = sum(map(lambda x: x.width, self.letters))
-        self.dot_width += (len(self.letters) - 1) # <-- spaces between letters 
-        
+        self.rasterize()
+        # Actual width of the string, spaces between letters included
+        self.height, self.dot_width = self.strip.shape
+
         # Starts off limit
         self.current_pos = (self.coords[0] + width, self.coords[1]) 
 
+    def rasterize(self):
+        """Render the letters once into a strip, with a mask of the columns covered by a letter"""
+        text = "".join(letter.symbol or " " for letter in self.letters)
+        self.strip, self.mask = self.font.render(text)
+        # Both colors are precomputed so that drawing is a plain masked copy
+        self.strips = {False: self.strip, True: 1 ^ self.strip}
+
     def set_pos(self, coords:tuple):
         """Setter for the current position
 
@@ -99,39 +115,41 @@ class String:
         Args:
             - inverted (bool, optional): Determine if the letter are green or disabled. Defaults to False.
         """
-        temp_width = 0
-        for letter in self.letters:
-            letter.coords = (self.current_pos[0] + temp_width, self.coords[1])
-            letter_right = letter.coords[0] + letter.width
-            # Verify if the letter overflow on the right
-            if letter_right <= self.xlimit :
-                limit = False
-            elif letter_right > self.xlimit and letter.coords[0] <= self.xlimit:
-                limit = self.xlimit
-            else:
-                break
-
-            letter.draw(self.image, inverted, xbounds=(self.coords[0], limit)) 
-            temp_width += letter.width + 1
-
-    def scroll(self, inverted=False):
+        x0 = math.floor(self.current_pos[0])
+        y = self.coords[1]
+        left = max(self.coords[0], x0, 0)
+        right = min(self.xlimit + 1, x0 + self.dot_width, self.image.shape[1])
+        if right <= left:
+            return
+
+        window = slice(left - x0, right - x0)
+        blit(self.image, self.strips[inverted][:, window], self.mask[:, window], y, left)
+
+    def scroll(self, inverted=False, dt=None):
         """Scroll the text, starts off the bounds then comme on the cross
 
         Args:
             - inverted (bool, optional): Determine if the letter are green or disabled. Defaults to False.
+            - dt (float, optional): time elapsed since the previous call, measured (at most MAX_SCROLL_DT) if None. Defaults to None.
         """
+        now = time.perf_counter()
+        if dt is None:
+            dt = 0.0 if self.time is None else min(now - self.time, MAX_SCROLL_DT)
+        self.time = now
+
         if self.timeout_state:
-            if time.time() - self.time >= self.timeout:
-                self.timeout_state = False
-            else:
+            self.timeout_left -= dt
+            if self.timeout_left > 0:
                 return
-        if time.time() - self.time >= self.cooldown:
-            self.set_pos((self.current_pos[0] - 1, self.current_pos[1]))
-            self.time = time.time()
+            self.timeout_state = False
+            dt = -self.timeout_left
+
+        self.set_pos((self.current_pos[0] - self.speed * dt, self.current_pos[1]))
         self.draw(inverted)
         if self.current_pos[0] + self.dot_width < self.coords[0]:
             self.current_pos = (self.coords[0] + self.width, self.coords[1])
             self.timeout_state = True
+            self.timeout_left = self.timeout
 
 if __name__ == '__main__':
     INVERTED:bool = True # Set the color of the letters to green or disabled
@@ -139,16 +157,14 @@ if __name__ == '__main__':
     pygame.init()
     screen = PharmaScreen(color_scale=False)
 
-    image = [[0 for c in range(SCREEN_SIZE)] for r in range(SCREEN_SIZE)]
+    image = np.zeros((SCREEN_SIZE, SCREEN_SIZE))
     s = String(image, (1, 18), 45, "I use Arch btw", cooldown=0.05, timeout=2)
     
     running = True
     while running:
         
         # Color for the middle line of the cross 
-        for line in image[16:32]:
-            for i in range(len(line)):
-                line[i] = (int(INVERTED))
+        image[16:32] = int(INVERTED)
 
         s.scroll(inverted=INVERTED)
 
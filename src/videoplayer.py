@@ -9,23 +9,25 @@ VIDEO_FILE = "_sylvqin.gif"
 FORCED_FRAMERATE = None
 INVERT_COLORS = False
 PLAY_AUDIO = False
+DITHER = False  # Dithered 1 bit sub-frames at 60FPS, for controllers that decode the binary wire format
 
 
-def frame_to_image(frame, invert_colors=False):
+def frame_to_image(frame, invert_colors=False, out_height=SCREEN_SIZE, out_width=SCREEN_SIZE):
     """
     Converts a frame from a video file to a 2D array of floats representing the pixel values.
-    This assumes that the video is in landscape mode.
+    This assumes that the video is wider than the output, e.g. landscape mode for a single cross.
+    The output size can be set to fill a pharmawall.VideoWall canvas.
     """
     grayscale_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-    # Scale the image to fit SCREEN_SIZE in height
+    # Scale the image to fit the output height
     height, width = grayscale_frame.shape
-    scaled_width = int(width * SCREEN_SIZE / height)
-    scaled_frame = cv2.resize(grayscale_frame, (scaled_width, SCREEN_SIZE))
+    scaled_width = int(width * out_height / height)
+    scaled_frame = cv2.resize(grayscale_frame, (scaled_width, out_height))
 
-    # Crop the image to SCREEN_SIZE in width
-    start_col = (scaled_width - SCREEN_SIZE) // 2
-    cropped_frame = scaled_frame[:, start_col : start_col + SCREEN_SIZE]
+    # Crop the image to the output width
+    start_col = (scaled_width - out_width) // 2
+    cropped_frame = scaled_frame[:, start_col : start_col + out_width]
 
     # Normalize the pixel values to the [0.0, 1.0] range and (row, column) order
     normalized_frame = cropped_frame / 255.0
@@ -49,7 +51,7 @@ if __name__ == "__main__":
         vclip.audio.write_audiofile("temp_audio.mp3")
 
     pygame.init()
-    screen = PharmaScreen()
+    screen = PharmaScreen("dither", wire_format="binary") if DITHER else PharmaScreen()
 
     if PLAY_AUDIO:
         pygame.mixer.music.load("temp_audio.mp3")
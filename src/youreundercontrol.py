@@ -13,7 +13,7 @@ if __name__ == "__main__":
     pygame.init()
     screen = PharmaScreen()
     matrix = np.zeros((size, size), dtype=int)
-    screen.set_image(matrix.tolist())
+    screen.set_image(matrix)
 
     running = True
     while running:
@@ -29,4 +29,4 @@ if __name__ == "__main__":
                     matrix[i][j] = 1
                 else:
                     matrix[i][j] = 0
-        screen.set_image(matrix.tolist())
+        screen.set_image(matrix)